@@ -0,0 +1,34 @@
+"""Add size and mtime to file_hash
+
+Revision ID: 3f2a9c1d7b4e
+Revises: 
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b4e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'file_hash',
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        schema='hashes'
+    )
+    op.add_column(
+        'file_hash',
+        sa.Column('mtime', sa.Float(), nullable=True),
+        schema='hashes'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('file_hash', 'mtime', schema='hashes')
+    op.drop_column('file_hash', 'size', schema='hashes')
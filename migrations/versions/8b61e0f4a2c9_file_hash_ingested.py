@@ -0,0 +1,40 @@
+"""Add ingested offset to file_hash
+
+Revision ID: 8b61e0f4a2c9
+Revises: 3f2a9c1d7b4e
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b61e0f4a2c9'
+down_revision = '3f2a9c1d7b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'file_hash',
+        sa.Column('offset', sa.BigInteger(), nullable=True),
+        schema='hashes'
+    )
+    op.add_column(
+        'file_hash',
+        sa.Column('rows', sa.Integer(), nullable=True),
+        schema='hashes'
+    )
+    op.add_column(
+        'file_hash',
+        sa.Column('prefix_hash', sa.String(length=256), nullable=True),
+        schema='hashes'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('file_hash', 'prefix_hash', schema='hashes')
+    op.drop_column('file_hash', 'rows', schema='hashes')
+    op.drop_column('file_hash', 'offset', schema='hashes')
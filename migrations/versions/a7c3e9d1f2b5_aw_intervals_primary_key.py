@@ -0,0 +1,74 @@
+"""Add a primary key to aw.intervals and track its dirty dates
+
+Revision ID: a7c3e9d1f2b5
+Revises: e5a1f3c8b2d6
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d1f2b5'
+down_revision = 'e5a1f3c8b2d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('aw.intervals') IS NULL OR EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = to_regclass('aw.intervals')
+                AND contype = 'p'
+            ) THEN
+                RETURN;
+            END IF;
+            ALTER TABLE aw.intervals DROP COLUMN IF EXISTS index;
+            ALTER TABLE aw.intervals ALTER COLUMN seconds SET NOT NULL;
+            ALTER TABLE aw.intervals ADD CONSTRAINT intervals_pkey PRIMARY KEY (app, date);
+        END $$;
+        """
+    )
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('aw.notafkwindow') IS NULL OR to_regclass('aw._intervals_dirty') IS NOT NULL THEN
+                RETURN;
+            END IF;
+            CREATE TABLE aw._intervals_dirty (
+                date date PRIMARY KEY
+            );
+            INSERT INTO aw._intervals_dirty
+            SELECT DISTINCT date(timestamp) FROM aw.notafkwindow;
+            IF to_regproc('aw.create_dirty_date_triggers') IS NOT NULL THEN
+                CALL aw.create_dirty_date_triggers('notafkwindow', 'aw._intervals_dirty', 'intervals_dates');
+            END IF;
+        END $$;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('aw.notafkwindow') IS NOT NULL THEN
+                DROP TRIGGER IF EXISTS notafkwindow_insert_intervals_dates ON aw.notafkwindow;
+                DROP TRIGGER IF EXISTS notafkwindow_update_intervals_dates ON aw.notafkwindow;
+                DROP TRIGGER IF EXISTS notafkwindow_delete_intervals_dates ON aw.notafkwindow;
+            END IF;
+        END $$;
+        """
+    )
+    op.execute('DROP TABLE IF EXISTS aw._intervals_dirty')
+    op.execute('DROP TABLE IF EXISTS aw._intervals_meta')
+    op.execute(
+        'ALTER TABLE IF EXISTS aw.intervals DROP CONSTRAINT IF EXISTS intervals_pkey'
+    )
@@ -0,0 +1,49 @@
+"""Allow negative durations in the AW tsrange indexes
+
+Revision ID: b2d4f6a8c0e1
+Revises: a7c3e9d1f2b5
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d4f6a8c0e1'
+down_revision = 'a7c3e9d1f2b5'
+branch_labels = None
+depends_on = None
+
+TABLES = ['afkstatus', 'currentwindow', 'webtab', 'notafkwindow', 'notafktab']
+
+NEW_RANGE = (
+    "tsrange(timestamp + least(duration, 0) * interval '1 second', "
+    "timestamp + greatest(duration, 0) * interval '1 second', '[]')"
+)
+OLD_RANGE = "tsrange(timestamp, timestamp + duration * interval '1 second', '[]')"
+
+
+def recreate_index(table, expression):
+    op.execute(
+        f"""
+        DO $$
+        BEGIN
+            IF to_regclass('aw.{table}') IS NULL THEN
+                RETURN;
+            END IF;
+            DROP INDEX IF EXISTS aw.{table}_tsrange_idx;
+            CREATE INDEX {table}_tsrange_idx ON aw.{table} USING gist ({expression});
+        END $$;
+        """
+    )
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        recreate_index(table, NEW_RANGE)
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        recreate_index(table, OLD_RANGE)
@@ -0,0 +1,45 @@
+"""Add primary keys to the Android AW tables
+
+Revision ID: c4d8e2a7f913
+Revises: 8b61e0f4a2c9
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e2a7f913'
+down_revision = '8b61e0f4a2c9'
+branch_labels = None
+depends_on = None
+
+TABLES = ['android_unlock', 'android_currentwindow']
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.execute(
+            f"""
+            DO $$
+            BEGIN
+                IF to_regclass('aw.{table}') IS NOT NULL THEN
+                    IF NOT EXISTS (
+                        SELECT 1 FROM pg_constraint
+                        WHERE conrelid = to_regclass('aw.{table}')
+                        AND contype = 'p'
+                    ) THEN
+                        ALTER TABLE aw.{table} ADD PRIMARY KEY (id);
+                    END IF;
+                END IF;
+            END $$;
+            """
+        )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.execute(
+            f'ALTER TABLE IF EXISTS aw.{table} DROP CONSTRAINT IF EXISTS {table}_pkey'
+        )
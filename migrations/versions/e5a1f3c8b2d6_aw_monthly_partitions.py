@@ -0,0 +1,120 @@
+"""Partition the large AW tables by month
+
+Revision ID: e5a1f3c8b2d6
+Revises: c4d8e2a7f913
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1f3c8b2d6'
+down_revision = 'c4d8e2a7f913'
+branch_labels = None
+depends_on = None
+
+TABLES = ['afkstatus', 'currentwindow', 'webtab']
+
+
+def rename_to_old(table):
+    return f"""
+            ALTER TABLE aw.{table} RENAME TO {table}_old;
+            FOR index_name IN
+                SELECT indexname FROM pg_indexes
+                WHERE schemaname = 'aw' AND tablename = '{table}_old'
+            LOOP
+                EXECUTE format(
+                    'ALTER INDEX aw.%I RENAME TO %I', index_name, index_name || '_old'
+                );
+            END LOOP;
+    """
+
+
+def move_dependents(table):
+    return f"""
+            FOR trigger_def IN
+                SELECT pg_get_triggerdef(oid) FROM pg_trigger
+                WHERE tgrelid = to_regclass('aw.{table}_old') AND NOT tgisinternal
+            LOOP
+                EXECUTE replace(trigger_def, ' ON aw.{table}_old ', ' ON aw.{table} ');
+            END LOOP;
+            FOR function_oid IN
+                SELECT d.objid FROM pg_depend d
+                JOIN pg_class c ON c.reltype = d.refobjid
+                WHERE d.classid = 'pg_proc'::regclass
+                AND c.oid = to_regclass('aw.{table}_old')
+            LOOP
+                function_def := pg_get_functiondef(function_oid);
+                EXECUTE format('DROP FUNCTION %s', function_oid::regprocedure);
+                EXECUTE replace(function_def, 'aw.{table}_old', 'aw.{table}');
+            END LOOP;
+    """
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.execute(
+            f"""
+            DO $$
+            DECLARE
+                index_name text;
+                trigger_def text;
+                function_oid oid;
+                function_def text;
+                month date;
+            BEGIN
+                IF to_regclass('aw.{table}') IS NULL OR EXISTS (
+                    SELECT 1 FROM pg_partitioned_table
+                    WHERE partrelid = to_regclass('aw.{table}')
+                ) THEN
+                    RETURN;
+                END IF;
+                {rename_to_old(table)}
+                CREATE TABLE aw.{table} (LIKE aw.{table}_old INCLUDING DEFAULTS)
+                    PARTITION BY RANGE (timestamp);
+                ALTER TABLE aw.{table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, timestamp);
+                FOR month IN
+                    SELECT DISTINCT date_trunc('month', timestamp)::date FROM aw.{table}_old
+                LOOP
+                    EXECUTE format(
+                        'CREATE TABLE aw.%I PARTITION OF aw.{table} FOR VALUES FROM (%L) TO (%L)',
+                        '{table}_' || to_char(month, 'YYYY_MM'), month,
+                        (month + interval '1 month')::date
+                    );
+                END LOOP;
+                INSERT INTO aw.{table} SELECT * FROM aw.{table}_old;
+                {move_dependents(table)}
+                DROP TABLE aw.{table}_old;
+            END $$;
+            """
+        )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.execute(
+            f"""
+            DO $$
+            DECLARE
+                index_name text;
+                trigger_def text;
+                function_oid oid;
+                function_def text;
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_partitioned_table
+                    WHERE partrelid = to_regclass('aw.{table}')
+                ) THEN
+                    RETURN;
+                END IF;
+                {rename_to_old(table)}
+                CREATE TABLE aw.{table} (LIKE aw.{table}_old INCLUDING DEFAULTS);
+                ALTER TABLE aw.{table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id);
+                INSERT INTO aw.{table} SELECT * FROM aw.{table}_old;
+                {move_dependents(table)}
+                DROP TABLE aw.{table}_old;
+            END $$;
+            """
+        )
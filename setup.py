@@ -17,6 +17,9 @@ setup(
         'python-mpd2>=3.0.4',
         'python-dateutil>=2.8.2',
     ],
+    extras_require={
+        'parquet': ['pyarrow>=12.0.0'],
+    },
     entry_points='''
     [console_scripts]
     sqrt_data_agent_mpd=sqrt_data_agent.mpd:main
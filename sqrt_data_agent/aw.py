@@ -1,10 +1,12 @@
 # [[file:../org/aw.org::*Saving (Desktop)][Saving (Desktop):1]]
 import socket
 import argparse
+import csv
 import json
 import logging
 import os
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import pandas as pd
@@ -36,14 +38,29 @@ def save_last_updated(data):
 # Saving (Desktop):2 ends here
 
 # [[file:../org/aw.org::*Saving (Desktop)][Saving (Desktop):3]]
+_session = None
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=settings['aw']['workers']
+        )
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
 def get_data(bucket_id, last_updated=None):
     params = {}
     api = settings['aw']['api']
     if last_updated:
         params['start'] = last_updated
-    r = requests.get(f'{api}/0/buckets/{bucket_id}')
+    session = get_session()
+    r = session.get(f'{api}/0/buckets/{bucket_id}')
     bucket = r.json()
-    r = requests.get(f'{api}/0/buckets/{bucket_id}/events', params=params)
+    r = session.get(f'{api}/0/buckets/{bucket_id}/events', params=params)
     data = deque()
     for event in r.json():
         hostname = bucket['hostname']
@@ -67,6 +84,169 @@ def get_data(bucket_id, last_updated=None):
 # Saving (Desktop):3 ends here
 
 # [[file:../org/aw.org::*Saving (Desktop)][Saving (Desktop):4]]
+EVENT_FIELDS = {
+    'afkstatus': {'status': 'string'},
+    'currentwindow': {'app': 'string', 'title': 'string'},
+    'web.tab.current': {
+        'url': 'string',
+        'title': 'string',
+        'audible': 'boolean',
+        'incognito': 'boolean',
+        'tabCount': 'Int64',
+    },
+    'app.editor.activity': {
+        'file': 'string', 'project': 'string', 'language': 'string'
+    },
+}
+
+BASE_FIELDS = {
+    'id': 'string',
+    'bucket_id': 'string',
+    'hostname': 'string',
+    'duration': 'float64',
+    'timestamp': 'string',
+}
+
+
+def get_typed_df(df, fields):
+    df = df.astype({k: v for k, v in fields.items() if k != 'timestamp'})
+    df['timestamp'] = pd.to_datetime(
+        df['timestamp'], format='ISO8601', utc=True
+    )
+    return df
+
+
+class CsvEventWriter:
+    def __init__(self, filename, fields):
+        self._file = open(filename, 'w', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(list(fields.keys()))
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetEventWriter:
+    def __init__(self, filename, fields):
+        self._filename = filename
+        self._fields = fields
+        self._rows = []
+        self._writer = None
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= settings['aw']['page_size']:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if len(self._rows) == 0:
+            return
+        df = pd.DataFrame(self._rows, columns=list(self._fields.keys()))
+        df = get_typed_df(df, self._fields)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self._filename, table.schema, compression='zstd'
+            )
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+EVENT_WRITERS = {
+    'csv': CsvEventWriter,
+    'parquet': ParquetEventWriter,
+}
+
+
+def get_events(bucket_id, last_updated=None):
+    api = settings['aw']['api']
+    params = {'limit': settings['aw']['page_size']}
+    if last_updated:
+        params['start'] = last_updated
+    prev_ids = set()
+    while True:
+        r = get_session().get(
+            f'{api}/0/buckets/{bucket_id}/events', params=params
+        )
+        events = r.json()
+        new_events = [e for e in events if e['id'] not in prev_ids]
+        yield from new_events
+        if len(events) < params['limit']:
+            break
+        if len(new_events) == 0:
+            logging.warning(
+                'More than %s events at %s in %s, stopping',
+                params['limit'], params['end'], bucket_id
+            )
+            break
+        params['end'] = events[-1]['timestamp']
+        prev_ids = {e['id'] for e in events}
+
+
+def save_events(bucket, filename, last_updated=None):
+    fields = EVENT_FIELDS.get(bucket['type'])
+    writer = None
+    count = 0
+    try:
+        for event in get_events(bucket['id'], last_updated):
+            if fields is None:
+                fields = {key: 'string' for key in event['data'].keys()}
+            if writer is None:
+                writer = EVENT_WRITERS[settings['general']['format']](
+                    f'{filename}.part', {**BASE_FIELDS, **fields}
+                )
+            writer.write(
+                [
+                    f"{bucket['id']}-{event['id']}",
+                    bucket['id'],
+                    bucket['hostname'],
+                    event['duration'],
+                    event['timestamp'],
+                    *[event['data'].get(field) for field in fields]
+                ]
+            )
+            count += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    if count > 0:
+        os.replace(f'{filename}.part', filename)
+    return count
+
+
+def save_bucket(bucket, filename, last_updated=None):
+    if settings['aw']['page_size'] > 0:
+        return save_events(bucket, filename, last_updated)
+    df = get_data(bucket['id'], last_updated)
+    if df is None:
+        return 0
+    if settings['general']['format'] == 'parquet':
+        fields = EVENT_FIELDS.get(bucket['type'])
+        if fields is None:
+            fields = {
+                key: 'string'
+                for key in df.columns if key not in BASE_FIELDS
+            }
+        fields = {**BASE_FIELDS, **fields}
+        df = get_typed_df(df.reset_index().reindex(columns=list(fields)), fields)
+        df.to_parquet(filename, index=False, compression='zstd')
+    else:
+        df.to_csv(filename)
+    return len(df)
+# Saving (Desktop):4 ends here
+
+# [[file:../org/aw.org::*Saving (Desktop)][Saving (Desktop):5]]
 def save_buckets(force=False):
     last_updated = get_last_updated()
     hostname = socket.gethostname()
@@ -76,12 +256,13 @@ def save_buckets(force=False):
         if (datetime.now().date() == last_updated_date and not force):
             logging.info('Already loaded AW today')
             return
-    r = requests.get(f'{settings["aw"]["api"]}/0/buckets')
+    r = get_session().get(f'{settings["aw"]["api"]}/0/buckets')
     buckets = r.json()
 
     os.makedirs(
         os.path.expanduser(settings['aw']['logs_folder']), exist_ok=True
     )
+    jobs = {}
     for bucket in buckets.values():
         if not bucket['type'] in settings['aw']['types']:
             continue
@@ -92,25 +273,36 @@ def save_buckets(force=False):
         if bucket['last_updated'] == last_updated.get(last_updated_id, None):
             logging.info('Bucket %s already saved', bucket['id'])
             continue
-        df = get_data(bucket['id'], last_updated.get(last_updated_id, None))
-        last_updated[last_updated_id] = bucket['last_updated']
-        if df is None:
-            logging.info('Bucket %s is empty', bucket['id'])
-            continue
         bucket_type = bucket['type'].replace('.', '_')
+        extension = settings['general']['format']
         hostname = bucket['hostname']
         if hostname == 'unknown':
             hostname = socket.gethostname()
         filename = os.path.join(
             os.path.expanduser(settings['aw']['logs_folder']),
-            f"{bucket_type}-{hostname}-{bucket['last_updated']}.csv"
+            f"{bucket_type}-{hostname}-{bucket['last_updated']}.{extension}"
         )
-        df.to_csv(filename)
-        logging.info('Saved %s with %s events', filename, len(df))
+        jobs[last_updated_id] = (
+            bucket, filename, last_updated.get(last_updated_id, None)
+        )
+    with ThreadPoolExecutor(max_workers=settings['aw']['workers']) as executor:
+        futures = {
+            executor.submit(save_bucket, *job): last_updated_id
+            for last_updated_id, job in jobs.items()
+        }
+        for future in as_completed(futures):
+            last_updated_id = futures[future]
+            bucket, filename, _ = jobs[last_updated_id]
+            count = future.result()
+            last_updated[last_updated_id] = bucket['last_updated']
+            if count == 0:
+                logging.info('Bucket %s is empty', bucket['id'])
+                continue
+            logging.info('Saved %s with %s events', filename, count)
     save_last_updated(last_updated)
-# Saving (Desktop):4 ends here
+# Saving (Desktop):5 ends here
 
-# [[file:../org/aw.org::*Saving (Desktop)][Saving (Desktop):5]]
+# [[file:../org/aw.org::*Saving (Desktop)][Saving (Desktop):6]]
 def main():
     parser = argparse.ArgumentParser(
         prog='sqrt_data_agent.aw'
@@ -121,4 +313,4 @@ def main():
 
 if __name__ == '__main__':
     main()
-# Saving (Desktop):5 ends here
+# Saving (Desktop):6 ends here
@@ -24,6 +24,8 @@ def get_year(datum):
 # Storing the library:2 ends here
 
 # [[file:../org/mpd.org::*Storing the library][Storing the library:3]]
+LIBRARY_DTYPES = {'duration': 'Int64', 'year': 'Int64'}
+
 def save_library():
     mpd = MPDClient()
     mpd.connect("localhost", 6600)
@@ -39,7 +41,21 @@ def save_library():
     csv_path = os.path.expanduser(settings['mpd']['library_csv'])
 
     os.makedirs(os.path.dirname(csv_path), exist_ok=True)
-    df.to_csv(csv_path, index=False)
+    if settings['general']['format'] == 'parquet':
+        df['duration'] = pd.to_numeric(df['duration'])
+        df = df.astype(
+            {
+                column: LIBRARY_DTYPES.get(column, 'string')
+                for column in df.columns
+            }
+        )
+        df.to_parquet(
+            os.path.splitext(csv_path)[0] + '.parquet',
+            index=False,
+            compression='zstd'
+        )
+    else:
+        df.to_csv(csv_path, index=False)
 
 if __name__ == '__main__':
     save_library()
@@ -1,7 +1,11 @@
 # [[file:../../org/core-new.org::*Connection][Connection:1]]
+import io
 import logging
+import re
 from contextlib import contextmanager
-from sqlalchemy import create_engine, text
+import numpy as np
+from sqlalchemy import MetaData, create_engine, inspect, text
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from .config import settings
@@ -69,4 +73,149 @@ class DBConn:
                 )
             ).scalar_one()
             return exists
+    @staticmethod
+    def copy_from_df(db, table, df, columns=None, force_not_null=None):
+        columns = columns or list(df.columns)
+        buffer = io.StringIO()
+        df[columns].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        options = 'FORMAT csv'
+        if force_not_null:
+            options += f', FORCE_NOT_NULL ({", ".join(force_not_null)})'
+        cursor = db.connection().connection.cursor()
+        cursor.copy_expert(
+            f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH ({options})',
+            buffer
+        )
+    @staticmethod
+    def stream_columns(db, query, params=None, dtypes=None, batch_size=100000):
+        if isinstance(query, str):
+            query = text(query)
+        dtypes = dtypes or {}
+        result = db.execute(
+            query, params or {}, execution_options={'stream_results': True}
+        )
+        keys = list(result.keys())
+        for rows in result.partitions(batch_size):
+            yield {
+                key: np.array(column, dtype=dtypes.get(key, object))
+                for key, column in zip(keys, zip(*rows))
+            }
+    @staticmethod
+    def get_partitions(table, db=None):
+        with DBConn.ensure_session(db) as db:
+            return db.execute(
+                text(
+                    """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+            ORDER BY c.relname
+            """
+                ), {'table': table}
+            ).scalars().all()
+    
+    @staticmethod
+    def is_partitioned(table, db=None):
+        with DBConn.ensure_session(db) as db:
+            return db.execute(
+                text(
+                    "SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+                ), {'table': table}
+            ).scalar_one()
+    
+    @staticmethod
+    def ensure_partitions(table, start, end, db=None):
+        with DBConn.ensure_session(db) as db:
+            if not DBConn.is_partitioned(table, db):
+                return
+            months = db.execute(
+                text(
+                    """
+            SELECT M::date, (M + interval '1 month')::date
+            FROM generate_series(
+                date_trunc('month', CAST(:start AS timestamp)),
+                date_trunc('month', CAST(:end AS timestamp)),
+                interval '1 month'
+            ) M
+            """
+                ), {'start': start, 'end': end}
+            ).all()
+            existing = set(DBConn.get_partitions(table, db))
+            schema, name = table.split('.')
+            for month_start, month_end in months:
+                partition = f'{name}_{month_start:%Y_%m}'
+                if partition in existing:
+                    continue
+                db.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {schema}.{partition} PARTITION OF {table} FOR VALUES FROM ('{month_start}') TO ('{month_end}')"
+                    )
+                )
+                logging.info('Created partition %s.%s', schema, partition)
+    @staticmethod
+    def create_index(conn, index, invalid, only=False):
+        schema = index.table.schema or 'public'
+        if (schema, index.name) in invalid and not only:
+            logging.info('Dropping invalid index %s', index.name)
+            conn.exec_driver_sql(
+                f'DROP INDEX CONCURRENTLY IF EXISTS {schema}.{index.name}'
+            )
+        sql = str(
+            CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect)
+        )
+        if only:
+            sql = sql.replace(
+                f' ON {index.table.fullname} ', f' ON ONLY {index.table.fullname} ', 1
+            )
+        else:
+            sql = re.sub(
+                r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY', sql
+            )
+        logging.info('Ensuring index %s', index.name)
+        conn.exec_driver_sql(sql)
+    
+    @staticmethod
+    def ensure_indexes(Base, schema=None):
+        engine = DBConn.engine.execution_options(isolation_level='AUTOCOMMIT')
+        with engine.connect() as conn:
+            invalid = set(
+                conn.execute(
+                    text(
+                        """
+                SELECT n.nspname, c.relname FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE NOT i.indisvalid AND c.relkind = 'i'
+                """
+                    )
+                ).all()
+            )
+            for table in Base.metadata.sorted_tables:
+                if schema is not None and table.schema != schema:
+                    continue
+                if not inspect(conn).has_table(table.name, table.schema):
+                    continue
+                partitioned = DBConn.is_partitioned(table.fullname, conn)
+                partitions = [
+                    table.to_metadata(MetaData(), name=partition)
+                    for partition in DBConn.get_partitions(table.fullname, conn)
+                ]
+                for index in sorted(table.indexes, key=lambda index: index.name):
+                    if not partitioned:
+                        DBConn.create_index(conn, index, invalid)
+                        continue
+                    DBConn.create_index(conn, index, invalid, only=True)
+                    parent = f'{table.schema or "public"}.{index.name}'
+                    attached = set(DBConn.get_partitions(parent, conn))
+                    for partition in partitions:
+                        partition_index = next(
+                            i for i in partition.indexes if i.name == index.name
+                        )
+                        partition_index.name = partition.name + index.name[len(table.name):]
+                        DBConn.create_index(conn, partition_index, invalid)
+                        if partition_index.name not in attached:
+                            conn.exec_driver_sql(
+                                f'ALTER INDEX {parent} ATTACH PARTITION {table.schema or "public"}.{partition_index.name}'
+                            )
 # Connection:1 ends here
@@ -1,8 +1,9 @@
 # [[file:../../org/core-new.org::*Hashes][Hashes:2]]
+import hashlib
 import logging
 import os
-import subprocess
 import sqlalchemy as sa
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from .config import settings
@@ -11,15 +12,31 @@ from sqrt_data_service.models import FileHash
 # Hashes:2 ends here
 
 # [[file:../../org/core-new.org::*Hashes][Hashes:3]]
-def md5sum(filename):
-    res = subprocess.run(
-        ['md5sum', filename],
-        capture_output=True,
-        check=True,
-        cwd=settings.general.root
-    ).stdout
-    res = res.decode('utf-8')
-    return res.split(' ')[0]
+BUFFER_SIZE = 1024 * 1024
+
+
+def md5sum(filename, size=None):
+    md5 = hashlib.md5()
+    with open(os.path.join(settings.general.root, filename), 'rb') as f:
+        while True:
+            to_read = BUFFER_SIZE
+            if size is not None:
+                to_read = min(to_read, size - f.tell())
+            chunk = f.read(to_read)
+            if not chunk:
+                break
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_stat(filename):
+    stat = os.stat(os.path.join(settings.general.root, filename))
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def get_state(filename):
+    stat = get_stat(filename)
+    return {'hash': md5sum(filename), **stat}
 # Hashes:3 ends here
 
 # [[file:../../org/core-new.org::*Hashes][Hashes:4]]
@@ -30,24 +47,119 @@ class FileHasher:
     def is_updated(self, file_name, db=None):
         if not os.path.exists(file_name):
             return False
+        return file_name in self.filter_updated([file_name], db)
+
+    def get_saved_hashes(self, file_names, db=None):
+        by_directory = {}
+        for file_name in file_names:
+            by_directory.setdefault(os.path.dirname(file_name),
+                                    []).append(file_name)
+        saved = {}
+        with DBConn.ensure_session(db) as db:
+            for directory, names in by_directory.items():
+                if directory == '':
+                    condition = FileHash.file_name.in_(names)
+                else:
+                    condition = FileHash.file_name.startswith(
+                        f'{directory}/', autoescape=True
+                    )
+                rows = db.execute(sa.select(FileHash).where(condition)).scalars()
+                saved.update({row.file_name: row for row in rows})
+        return saved
+
+    def get_states(self, file_names):
+        workers = settings['general']['hash_workers']
+        if workers <= 1 or len(file_names) <= 1:
+            return [get_state(f) for f in file_names]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(get_state, file_names))
+
+    def filter_updated(self, file_names, db=None):
+        file_names = [f for f in file_names if os.path.exists(f)]
+        saved = self.get_saved_hashes(file_names, db)
+        to_hash = []
+        for file_name in file_names:
+            row = saved.get(file_name)
+            stat = get_stat(file_name)
+            if (
+                row is not None and row.size == stat['size']
+                and row.mtime == stat['mtime']
+            ):
+                continue
+            to_hash.append(file_name)
+        updated, touched = {}, {}
+        for file_name, state in zip(to_hash, self.get_states(to_hash)):
+            row = saved.get(file_name)
+            if row is not None and row.hash == state['hash']:
+                touched[file_name] = state
+            else:
+                updated[file_name] = state
+        if len(to_hash) > 0:
+            logging.info(
+                'Hashed %d of %d files, %d updated',
+                len(to_hash), len(file_names), len(updated)
+            )
+        self.save_hashes(touched, db)
+        return updated
+
+    def get_ingested(self, file_name, db=None):
         with DBConn.ensure_session(db) as db:
             saved = db.execute(
                 sa.select(FileHash).where(FileHash.file_name == file_name)
             ).scalar_one_or_none()
-            if saved is None:
-                return True
-            return saved.hash != md5sum(file_name)
+        if saved is None or saved.offset is None:
+            return 0, 0
+        if get_stat(file_name)['size'] < saved.offset:
+            return 0, 0
+        if md5sum(file_name, saved.offset) != saved.prefix_hash:
+            logging.info('Prefix of %s has changed', file_name)
+            return 0, 0
+        return saved.offset, saved.rows
+
+    def get_ingested_state(self, file_name, offset, rows):
+        return {
+            'offset': offset,
+            'rows': rows,
+            'prefix_hash': md5sum(file_name, offset)
+        }
 
     def save_hash(self, file_name, db=None):
-        hash = md5sum(file_name)
+        self.save_hashes({file_name: get_state(file_name)}, db)
+
+    def save_hashes(self, hashes, db=None):
+        if len(hashes) == 0:
+            return
         was_ensured = db is None
         with DBConn.ensure_session(db) as db:
-            insert_stmt = pg_insert(FileHash)
+            insert_stmt = pg_insert(FileHash).values(
+                [
+                    {
+                        'file_name': file_name,
+                        'offset': None,
+                        'rows': None,
+                        'prefix_hash': None,
+                        **state
+                    } for file_name, state in hashes.items()
+                ]
+            )
             upsert_stmt = insert_stmt.on_conflict_do_update(
                 constraint='file_hash_pkey',
-                set_={'hash': insert_stmt.excluded.hash}
+                set_={
+                    'hash': insert_stmt.excluded.hash,
+                    'size': insert_stmt.excluded.size,
+                    'mtime': insert_stmt.excluded.mtime,
+                    'offset': sa.func.coalesce(
+                        insert_stmt.excluded.offset, FileHash.offset
+                    ),
+                    'rows': sa.func.coalesce(
+                        insert_stmt.excluded.rows, FileHash.rows
+                    ),
+                    'prefix_hash': sa.func.coalesce(
+                        insert_stmt.excluded.prefix_hash, FileHash.prefix_hash
+                    ),
+                }
             )
-            db.execute(upsert_stmt, { 'file_name': file_name, 'hash': hash })
+            db.execute(upsert_stmt)
             if was_ensured:
                 db.commit()
 # Hashes:4 ends here
@@ -1,10 +1,12 @@
 # [[file:../../org/locations.org::*Matching locations][Matching locations:1]]
+import os
+
+import numpy as np
 import pandas as pd
 
-from datetime import timedelta
 from sqrt_data_service.api import settings
 
-__all__ = ['LocationMatcher']
+__all__ = ['LocationMatcher', 'get_location_matcher']
 
 
 class LocationMatcher:
@@ -21,6 +23,7 @@ class LocationMatcher:
         )
 
         self._init_timezones()
+        self._init_lookups()
 
     def _init_timezones(self):
         self._timezones = {
@@ -34,19 +37,76 @@ class LocationMatcher:
             self._timezones[l] for l in self._df_hostnames['location']
         ]
 
+    def _init_lookups(self):
+        hostnames = self._df_hostnames.drop_duplicates(
+            'hostname'
+        ).sort_values(by='hostname')
+        self._hostnames = hostnames['hostname'].to_numpy(dtype=str)
+        self._hostname_locations = hostnames['location'].to_numpy()
+        self._hostname_timezones = hostnames['timezone'].to_numpy()
+
+        df_list = self._df_list.sort_values(by='start_time')
+        self._start_times = df_list['start_time'].to_numpy(
+            dtype='datetime64[ns]'
+        )
+        self._list_locations = df_list['location'].to_numpy()
+        self._list_timezones = df_list['timezone'].to_numpy()
+
+    def get_locations(self, timestamps, hostnames=None):
+        timestamps = pd.DatetimeIndex(timestamps)
+        times = timestamps
+        if times.tz is not None:
+            times = times.tz_convert(None)
+        times = times.to_numpy(dtype='datetime64[ns]')
+
+        host_idx = np.full(len(times), -1)
+        if hostnames is not None and len(self._hostnames) > 0:
+            hostnames = pd.Series(hostnames).fillna('').to_numpy(dtype=str)
+            idx = np.searchsorted(self._hostnames, hostnames)
+            idx[idx == len(self._hostnames)] = 0
+            found = self._hostnames[idx] == hostnames
+            host_idx[found] = idx[found]
+
+        locations = np.empty(len(times), dtype=object)
+        timezones = np.zeros(len(times), dtype=np.int64)
+
+        matched = host_idx >= 0
+        locations[matched] = self._hostname_locations[host_idx[matched]]
+        timezones[matched] = self._hostname_timezones[host_idx[matched]]
+
+        rest = ~matched
+        list_idx = np.searchsorted(
+            self._start_times, times[rest], side='left'
+        ) - 1
+        if (list_idx < 0).any():
+            raise IndexError(
+                f'No location found for {times[rest][list_idx < 0][0]}'
+            )
+        locations[rest] = self._list_locations[list_idx]
+        timezones[rest] = self._list_timezones[list_idx]
+
+        return (locations, timestamps + pd.to_timedelta(timezones, unit='h'))
+
     def get_location(self, time, hostname=None):
-        if hostname is not None:
-            matches = self._df_hostnames[self._df_hostnames.hostname == hostname
-                                        ]
-            if len(matches) > 0:
-                match = matches.iloc[0]
-                time += timedelta(seconds=60 * 60 * int(match.timezone))
-                return (match.location, time)
-        row = self._df_list[self._df_list.start_time < time.to_datetime64()
-                           ].iloc[0]
-        time += timedelta(seconds=60 * 60 * int(row.timezone))
-        return (row.location, time)
+        locations, times = self.get_locations([time], [hostname])
+        return (locations[0], times[0])
+# Matching locations:1 ends here
+
+# [[file:../../org/locations.org::*Matching locations][Matching locations:2]]
+_matcher = None
+_matcher_mtimes = None
+
+def get_location_matcher():
+    global _matcher, _matcher_mtimes
+    mtimes = [
+        os.path.getmtime(settings['location'][key])
+        for key in ['tz_csv', 'list_csv', 'hostnames_csv']
+    ]
+    if _matcher is None or mtimes != _matcher_mtimes:
+        _matcher = LocationMatcher()
+        _matcher_mtimes = mtimes
+    return _matcher
 
 if __name__ == '__main__':
-    LocationMatcher()
-# Matching locations:1 ends here
+    get_location_matcher()
+# Matching locations:2 ends here
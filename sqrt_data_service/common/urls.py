@@ -0,0 +1,107 @@
+# [[file:../../org/aw.org::*URL normalization][URL normalization:1]]
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import furl
+import tldextract
+
+from sqrt_data_service.api import settings
+
+__all__ = ['UrlNormalizer', 'get_url_normalizer', 'safe_furl_no_params']
+# URL normalization:1 ends here
+
+# [[file:../../org/aw.org::*URL normalization][URL normalization:2]]
+def safe_furl_no_params(url):
+    try:
+        return furl.furl(url).remove(args=True, fragment=True).url
+    except ValueError:
+        logging.warning('Bad URL: %s', url)
+        return url
+# URL normalization:2 ends here
+
+# [[file:../../org/aw.org::*URL normalization][URL normalization:3]]
+class UrlNormalizer:
+    def __init__(self, max_size, cache_file=None):
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._new = {}
+        self._dirty = False
+        self._extract = tldextract.TLDExtract(
+            cache_dir=None, suffix_list_urls=()
+        )
+        if self.cache_file is not None:
+            self.load()
+
+    def normalize(self, url):
+        try:
+            result = self._cache[url]
+        except KeyError:
+            self.misses += 1
+            result = (
+                self._extract(url).registered_domain,
+                safe_furl_no_params(url)
+            )
+            self._new[url] = result
+            if len(self._new) > self.max_size:
+                del self._new[next(iter(self._new))]
+            self._put(url, result)
+            return result
+        self.hits += 1
+        self._cache.move_to_end(url)
+        return result
+
+    def _put(self, url, result):
+        self._cache[url] = result
+        self._dirty = True
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def pop_new(self):
+        new, self._new = self._new, {}
+        return new
+
+    def update(self, entries):
+        for url, result in entries.items():
+            if url not in self._cache:
+                self._put(url, tuple(result))
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, 'r') as f:
+            data = json.load(f)
+        for url, site, url_no_params in data[-self.max_size:]:
+            self._cache[url] = (site, url_no_params)
+
+    def save(self):
+        if self.cache_file is None or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = f'{self.cache_file}.{os.getpid()}'
+        with open(tmp_file, 'w') as f:
+            json.dump([[url, *result] for url, result in self._cache.items()], f)
+        os.replace(tmp_file, self.cache_file)
+        self._dirty = False
+        logging.info(
+            'Saved %d URLs to cache, hits: %d, misses: %d',
+            len(self._cache), self.hits, self.misses
+        )
+# URL normalization:3 ends here
+
+# [[file:../../org/aw.org::*URL normalization][URL normalization:4]]
+_normalizer = None
+
+def get_url_normalizer():
+    global _normalizer
+    if _normalizer is None:
+        _normalizer = UrlNormalizer(
+            settings['aw']['url_cache_size'],
+            settings['aw']['url_cache_file'] or None
+        )
+    return _normalizer
+# URL normalization:4 ends here
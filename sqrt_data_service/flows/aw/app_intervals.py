@@ -1,8 +1,14 @@
 # [[file:../../../org/aw.org::*App Interval][App Interval:1]]
-from tqdm import tqdm
+import concurrent.futures
+import logging
+
 from sqrt_data_service.api import settings, DBConn
+from sqrt_data_service.models import Base
+from sqrt_data_service.models.aw import AppIntervalWatermark
 
+import numpy as np
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import pandas as pd
 # App Interval:1 ends here
 
@@ -10,72 +16,173 @@ import pandas as pd
 __all__ = ['process_app_intervals']
 # App Interval:2 ends here
 
-# [[file:../../../org/aw.org::*App Interval][App Interval:3]]
-def extract_data(db=None):
-    apps = ', '.join([f"'{app}'" for app in settings.aw.app_interval.apps])
-    sql = f"SELECT app, timestamp FROM aw.notafkwindow WHERE app in ({apps}) ORDER BY timestamp ASC"
-    with DBConn.ensure_session(db) as db:
-        data = db.execute(sa.text(sql)).all()
-
-    app_timestamps = {}
-    for app, timestamp in data:
-        try:
-            app_timestamps[app].append(timestamp)
-        except KeyError:
-            app_timestamps[app] = [timestamp]
-    return app_timestamps
-# App Interval:3 ends here
-
 # [[file:../../../org/aw.org::*App Interval][App Interval:4]]
-def process_data(app_timestamps):
-    time_by_day = {}
-    for app, timestamps in app_timestamps.items():
-        intervals = []
-        start = timestamps[0]
-        end = timestamps[0]
-        for timestamp in tqdm(timestamps[1:]):
-            delta = (timestamp - end).total_seconds()
-            if delta > settings.aw.app_interval.interval:
-                if end > start:
-                    intervals.append((start, end))
-                start = timestamp
-                end = timestamp
-            else:
-                end = timestamp
-        if end > start:
-            intervals.append((start, end))
+def lower_watermarks(db):
+    db.execute(
+        """
+    WITH D AS (DELETE FROM aw._intervals_dirty RETURNING date)
+    UPDATE aw._intervals_meta W
+    SET timestamp = (SELECT min(D.date) - 1 FROM D)
+    WHERE W.timestamp > (SELECT min(D.date) - 1 FROM D)
+    """
+    )
 
-        time_by_day[app] = {}
-        for start, end in intervals:
-            date = start.date()
-            delta = (end - start).total_seconds()
-            try:
-                time_by_day[app][date] += delta
-            except KeyError:
-                time_by_day[app][date] = delta
-    return time_by_day
+def get_watermarks(db):
+    return dict(
+        db.execute(
+            sa.select(AppIntervalWatermark.app, AppIntervalWatermark.timestamp)
+        ).all()
+    )
 # App Interval:4 ends here
 
 # [[file:../../../org/aw.org::*App Interval][App Interval:5]]
-def save_data(time_by_day):
-    data = []
-    for app, times_per_app in time_by_day.items():
-        for date, seconds in times_per_app.items():
-            data.append((app, date, seconds))
-    df = pd.DataFrame(data, columns=["app", "date", "seconds"])
-    df.to_sql(
-        "intervals",
-        schema=settings["aw"]["schema"],
-        con=DBConn.engine,
-        if_exists="replace",
+def extract_data(db=None):
+    apps = ', '.join([f"'{app}'" for app in settings.aw.app_interval.apps])
+    sql = f"""
+    SELECT N.app, N.timestamp FROM aw.notafkwindow N
+    LEFT JOIN aw._intervals_meta W ON N.app = W.app
+    WHERE N.app in ({apps}) AND (
+        W.timestamp IS NULL OR
+        N.timestamp >= W.timestamp - make_interval(secs => :interval)
     )
+    ORDER BY N.timestamp ASC
+    """
+    app_batches = {}
+    with DBConn.ensure_session(db) as db:
+        for batch in DBConn.stream_columns(
+            db,
+            sql, {'interval': settings.aw.app_interval.interval},
+            dtypes={'timestamp': 'datetime64[us]'}
+        ):
+            for app in np.unique(batch['app']):
+                app_batches.setdefault(app, []).append(
+                    batch['timestamp'][batch['app'] == app]
+                )
+    return {
+        app: np.concatenate(batches)
+        for app, batches in app_batches.items()
+    }
 # App Interval:5 ends here
 
 # [[file:../../../org/aw.org::*App Interval][App Interval:6]]
-def process_app_intervals():
+def get_sessions(timestamps):
+    timestamps_us = np.asarray(timestamps,
+                               dtype='datetime64[us]').astype(np.int64)
+    interval = settings.aw.app_interval.interval
+    is_break = np.diff(timestamps_us) / 1e6 > interval
+    session_id = np.concatenate([[0], np.cumsum(is_break)])
+    starts = np.flatnonzero(np.diff(session_id, prepend=-1))
+    ends = np.append(starts[1:], len(timestamps_us)) - 1
+    return timestamps_us[starts], timestamps_us[ends]
+
+def sum_sequential(values, group_starts):
+    group = np.repeat(
+        np.arange(len(group_starts)),
+        np.diff(group_starts, append=len(values))
+    )
+    position = np.arange(len(values)) - group_starts[group]
+    padded = np.zeros((len(group_starts), position.max(initial=0) + 1))
+    padded[group, position] = values
+    return np.cumsum(padded, axis=1)[:, -1]
+
+def get_time_by_day(app, timestamps, since=None):
+    start, end = get_sessions(timestamps)
+    if since is not None:
+        is_new = start >= np.datetime64(since, 'us').astype(np.int64)
+        start, end = start[is_new], end[is_new]
+    if len(start) == 0:
+        return pd.DataFrame(columns=['app', 'date', 'seconds']), None
+    dates = start.astype('datetime64[us]').astype('datetime64[D]')
+    watermark = start[np.searchsorted(dates, dates[-1])]
+
+    is_interval = end > start
+    start, end, dates = start[is_interval], end[is_interval], dates[is_interval]
+    unique_dates, date_starts = np.unique(dates, return_index=True)
+    df = pd.DataFrame(
+        {
+            'app': app,
+            'date': pd.Series(unique_dates, dtype='datetime64[ns]').dt.date,
+            'seconds': sum_sequential((end - start) / 1e6, date_starts)
+        }
+    )
+    return df, watermark.astype('datetime64[us]').item()
+
+def process_data(app_timestamps, workers=None, since=None):
+    since = since or {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        results = list(
+            executor.map(
+                get_time_by_day, app_timestamps.keys(),
+                app_timestamps.values(),
+                [since.get(app) for app in app_timestamps.keys()]
+            )
+        )
+    watermarks = {
+        app: watermark
+        for app, (_, watermark) in zip(app_timestamps.keys(), results)
+        if watermark is not None
+    }
+    dfs = [df for df, _ in results if len(df) > 0]
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=['app', 'date', 'seconds']), watermarks
+    return pd.concat(dfs, ignore_index=True), watermarks
+# App Interval:6 ends here
+
+# [[file:../../../org/aw.org::*App Interval][App Interval:7]]
+def save_data(db, df, watermarks):
+    db.execute('DROP TABLE IF EXISTS _intervals_staging')
+    db.execute(
+        'CREATE TEMP TABLE _intervals_staging '
+        '(LIKE aw.intervals INCLUDING DEFAULTS)'
+    )
+    DBConn.copy_from_df(db, '_intervals_staging', df, ['app', 'date', 'seconds'])
+    db.execute(
+        sa.text(
+            """
+    DELETE FROM aw.intervals I
+    WHERE I.app = ANY(:apps)
+      AND I.date >= coalesce((SELECT date(W.timestamp) FROM aw._intervals_meta W WHERE W.app = I.app), '-infinity')
+      AND NOT EXISTS (SELECT 1 FROM _intervals_staging S WHERE S.app = I.app AND S.date = I.date)
+    """
+        ), {'apps': list(settings.aw.app_interval.apps)}
+    )
+    db.execute(
+        """
+    INSERT INTO aw.intervals (app, date, seconds)
+    SELECT app, date, seconds FROM _intervals_staging
+    ON CONFLICT (app, date) DO UPDATE SET seconds = EXCLUDED.seconds
+    """
+    )
+    db.execute('DROP TABLE _intervals_staging')
+    if len(watermarks) > 0:
+        query = pg_insert(AppIntervalWatermark).values(
+            [
+                {'app': app, 'timestamp': timestamp}
+                for app, timestamp in watermarks.items()
+            ]
+        )
+        db.execute(
+            query.on_conflict_do_update(
+                index_elements=['app'],
+                set_={'timestamp': query.excluded.timestamp}
+            )
+        )
+    logging.info('Saved %d app intervals', len(df))
+# App Interval:7 ends here
+
+# [[file:../../../org/aw.org::*App Interval][App Interval:8]]
+def process_app_intervals(workers=None, full=False):
     DBConn()
+    DBConn.create_schema('aw', Base)
     with DBConn.get_session() as db:
+        if full:
+            db.execute('DELETE FROM aw.intervals')
+            db.execute('DELETE FROM aw._intervals_meta')
+            db.execute('DELETE FROM aw._intervals_dirty')
+        lower_watermarks(db)
+        since = get_watermarks(db)
         raw_data = extract_data(db)
-        time_by_day = process_data(raw_data)
-        save_data(time_by_day)
-# App Interval:6 ends here
+        df, watermarks = process_data(raw_data, workers, since)
+        save_data(db, df, watermarks)
+        db.commit()
+# App Interval:8 ends here
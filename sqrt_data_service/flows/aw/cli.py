@@ -17,26 +17,35 @@ def aw():
     pass
 
 @aw.command(help="Load desktop data", name="load-desktop")
-def aw_load_desktop_cmd():
-    aw_load_desktop()
+@click.option('-w', '--workers', type=int, default=None)
+def aw_load_desktop_cmd(workers):
+    aw_load_desktop(workers)
 
 @aw.command(help="Load android data", name="load-android")
 def aw_load_android_cmd():
     aw_load_android()
 
 @aw.command(help="Process app intervals", name="process-app-intervals")
-def aw_process_app_intervals_cmd():
-    process_app_intervals()
+@click.option('-w', '--workers', type=int, default=None)
+@click.option('--full', is_flag=True, default=False)
+def aw_process_app_intervals_cmd(workers, full):
+    process_app_intervals(workers, full)
 
 @aw.command(help="Postprocessing init", name="postprocessing-init")
 def aw_postprocessing_init_cmd():
     aw_postprocessing_init()
 
 @aw.command(help="Postprocessing dispatch", name="postprocessing-dispatch")
-def aw_postprocessing_dispatch_cmd():
-    aw_postprocessing_dispatch()
+@click.option('-p', '--parallel', type=int, default=None)
+def aw_postprocessing_dispatch_cmd(parallel):
+    aw_postprocessing_dispatch(parallel)
 
 @aw.command(help="Process all", name="process-all")
-def aw_process_all_cmd():
-    aw_process()
+@click.option('-w', '--workers', type=int, default=None)
+@click.option('-p', '--parallel', type=int, default=None)
+@click.option('-i', '--interval-workers', type=int, default=None)
+def aw_process_all_cmd(workers, parallel, interval_workers):
+    aw_process(
+        workers=workers, parallel=parallel, interval_workers=interval_workers
+    )
 # CLI & Init:1 ends here
@@ -1,19 +1,22 @@
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):1]]
-import furl
-import tldextract
 import glob
+import concurrent.futures
+import datetime
 import pandas as pd
 import os
 import re
 import logging
+from collections import deque
 
+import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from tqdm import tqdm
 
 from sqrt_data_service.api import settings, DBConn, FileHasher
 from sqrt_data_service.models import Base
 from sqrt_data_service.models.aw import AfkStatus, CurrentWindow, AppEditor, WebTab
-from sqrt_data_service.common.locations import LocationMatcher
+from sqrt_data_service.common.locations import get_location_matcher
+from sqrt_data_service.common.urls import get_url_normalizer
 # Loading (Desktop):1 ends here
 
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):2]]
@@ -21,32 +24,31 @@ __all__ = ['aw_load_desktop']
 # Loading (Desktop):2 ends here
 
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):3]]
-def get_dataframes(db):
-    files = glob.glob(
-        f'{os.path.expanduser(settings["aw"]["logs_folder"])}/*.csv'
+def get_files(db):
+    folder = os.path.expanduser(settings["aw"]["logs_folder"])
+    files = sorted(
+        glob.glob(f'{folder}/*.csv') + glob.glob(f'{folder}/*.parquet')
     )
-    dfs_by_type = {}
-    files_by_type = {}
     hasher = FileHasher()
-    for f in tqdm(files):
-        if not hasher.is_updated(f, db):
-            continue
-        try:
-            df = pd.read_csv(f, lineterminator='\n', index_col=False)
-        except pd.errors.ParserError:
-            logging.error(f'Error parsing file: {f}')
-            continue
-        type_ = re.search(r'^\w+', os.path.basename(f)).group(0)
-        try:
-            dfs_by_type[type_].append(df)
-            files_by_type[type_].append(f)
-        except KeyError:
-            dfs_by_type[type_] = [df]
-            files_by_type[type_] = [f]
-        hasher.save_hash(f, db)
-    # for type, files in files_by_type.items():
-    #     logging.info(f'AW {type}: {"; ".join(files)}')
-    return dfs_by_type
+    return hasher.filter_updated(files, db)
+
+def get_type(file_name):
+    return re.search(r'^\w+', os.path.basename(file_name)).group(0)
+
+def read_chunks(file_name):
+    if file_name.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(file_name).iter_batches(
+            batch_size=settings['aw']['chunk_size']
+        )
+        return (batch.to_pandas() for batch in batches)
+    return pd.read_csv(
+        file_name,
+        lineterminator='\n',
+        index_col=False,
+        chunksize=settings['aw']['chunk_size']
+    )
 # Loading (Desktop):3 ends here
 
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):4]]
@@ -59,15 +61,8 @@ MODELS = {
 # Loading (Desktop):4 ends here
 
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):5]]
-def safe_furl_no_params(url):
-    try:
-        return furl.furl(url).remove(args=True, fragment=True).url
-    except ValueError:
-        logging.warning('Bad URL: %s', url)
-        return url
-
 def get_records(type_, df):
-    loc = LocationMatcher()
+    loc = get_location_matcher()
     if type_ == 'afkstatus':
         df['status'] = df['status'] == 'not-afk'
     if type_ == 'currentwindow':
@@ -76,46 +71,173 @@ def get_records(type_, df):
         )
     if type_ == 'web_tab_current':
         df = df.rename({'tabCount': 'tab_count'}, axis=1)
-        df['site'] = [
-            tldextract.extract(url).registered_domain
-            for url in df['url']
-        ]
-        df['url_no_params'] = [
-            safe_furl_no_params(url)
-            for url in df['url']
-        ]
+        urls = get_url_normalizer()
+        normalized = [urls.normalize(url) for url in df['url']]
+        df['site'] = [n[0] for n in normalized]
+        df['url_no_params'] = [n[1] for n in normalized]
     if type_ == 'app_editor_activity':
         if 'branch' in df.columns:
             df = df.drop('branch', axis=1)
+    df = df.drop_duplicates('id')
     df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
-    locations = df.apply(
-        lambda row: loc.get_location(row.timestamp, row.hostname), axis=1
+    df['location'], df['timestamp'] = loc.get_locations(
+        df['timestamp'], df['hostname']
     )
-    df['location'] = [l[0] for l in locations]
-    df['timestamp'] = [l[1] for l in locations]
-    return df.to_dict(orient='records')
+    return df
 # Loading (Desktop):5 ends here
 
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):6]]
-def insert_data(type_, entries, db):
-    db.execute(
+DEDUPE_WINDOW = datetime.timedelta(days=1)
+
+def get_dedupe_range(start, end):
+    return start - DEDUPE_WINDOW, end + DEDUPE_WINDOW
+
+def insert_values(type_, df, db):
+    table = MODELS[type_].__table__
+    start, end = df['timestamp'].min(), df['timestamp'].max()
+    DBConn.ensure_partitions(table.fullname, start, end, db)
+    dedupe_start, dedupe_end = get_dedupe_range(start, end)
+    existing = db.execute(
+        sa.select(table.c.id).where(
+            table.c.timestamp.between(dedupe_start, dedupe_end),
+            table.c.id.in_(df['id'].tolist())
+        )
+    ).scalars().all()
+    entries = df[~df['id'].isin(existing)].to_dict(orient='records')
+    if len(entries) == 0:
+        return 0
+    result = db.execute(
         pg_insert(MODELS[type_]).values(entries).on_conflict_do_nothing()
     )
+    return result.rowcount
+
+def copy_to_staging(table, df, db):
+    columns = [c.name for c in table.columns if c.name in df.columns]
+    for column in table.columns:
+        if column.name in columns and isinstance(column.type, sa.Integer):
+            df[column.name] = df[column.name].astype('Int64')
+    not_null = [
+        c.name for c in table.columns if c.name in columns and
+        not c.nullable and isinstance(c.type, (sa.String, sa.Text))
+    ]
+
+    staging = f'_staging_{table.name}'
+    db.execute(sa.text(f'DROP TABLE IF EXISTS {staging}'))
+    db.execute(
+        sa.text(
+            f'CREATE TEMP TABLE {staging} (LIKE {table.fullname} INCLUDING DEFAULTS) ON COMMIT DROP'
+        )
+    )
+    db.execute(
+        sa.text(
+            f'ALTER TABLE {staging} ALTER COLUMN timestamp TYPE timestamptz'
+        )
+    )
+    DBConn.copy_from_df(db, staging, df, columns, force_not_null=not_null)
+    return staging, columns
+
+def insert_copy(type_, df, db):
+    table = MODELS[type_].__table__
+    staging, columns = copy_to_staging(table, df, db)
+    start, end = db.execute(
+        sa.text(
+            f'SELECT min(timestamp)::timestamp, max(timestamp)::timestamp FROM {staging}'
+        )
+    ).one()
+    DBConn.ensure_partitions(table.fullname, start, end, db)
+    dedupe_start, dedupe_end = get_dedupe_range(start, end)
+    column_list = ', '.join(columns)
+    result = db.execute(
+        sa.text(
+            f"""
+            INSERT INTO {table.fullname} ({column_list})
+            SELECT {column_list} FROM {staging} S
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table.fullname} T
+                WHERE T.id = S.id AND T.timestamp BETWEEN :start AND :end
+            )
+            ON CONFLICT DO NOTHING
+            """
+        ), {
+            'start': dedupe_start,
+            'end': dedupe_end
+        }
+    )
+    return result.rowcount
+
+INSERT_METHODS = {
+    'values': insert_values,
+    'copy': insert_copy
+}
+
+def insert_data(type_, df, db):
+    inserted = INSERT_METHODS[settings['aw']['load_method']](type_, df, db)
+    return inserted, len(df) - inserted
 # Loading (Desktop):6 ends here
 
 # [[file:../../../org/aw.org::*Loading (Desktop)][Loading (Desktop):7]]
-def aw_load_desktop():
+def transform_chunks(file_name):
+    type_ = get_type(file_name)
+    for df in read_chunks(file_name):
+        yield get_records(type_, df)
+
+def transform_chunk(type_, df):
+    return get_records(type_, df), get_url_normalizer().pop_new()
+
+def get_result(future):
+    df, urls = future.result()
+    get_url_normalizer().update(urls)
+    return df
+
+def transform_chunks_parallel(file_name, executor, workers):
+    type_ = get_type(file_name)
+    pending = deque()
+    for df in read_chunks(file_name):
+        pending.append(executor.submit(transform_chunk, type_, df))
+        if len(pending) >= workers * 2:
+            yield get_result(pending.popleft())
+    while len(pending) > 0:
+        yield get_result(pending.popleft())
+
+def get_transformed(files, workers=None):
+    if workers is None or workers <= 1:
+        for f in files:
+            yield f, transform_chunks(f)
+        return
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        for f in files:
+            yield f, transform_chunks_parallel(f, executor, workers)
+
+def load_file(file_name, dfs, db):
+    type_ = get_type(file_name)
+    inserted, skipped = 0, 0
+    for df in dfs:
+        chunk_inserted, chunk_skipped = insert_data(type_, df, db)
+        inserted += chunk_inserted
+        skipped += chunk_skipped
+    logging.info(
+        f'Inserted {inserted} records of type "{type_}", skipped {skipped}'
+    )
+
+def aw_load_desktop(workers=None):
     DBConn()
     DBConn.create_schema('aw', Base)
+    hasher = FileHasher()
     with DBConn.get_session() as db:
-        dfs_by_type = get_dataframes(db)
-
-        for type_, dfs in tqdm(dfs_by_type.items()):
-            for df in dfs:
-                if len(df) > 10000:
-                    logging.info(f'Inserting a large df ({len(df)}) of type "{type_}"')
-                entries = get_records(type_, df)
-                insert_data(type_, entries, db)
-                logging.info(f'Inserted {len(entries)} records of type "{type_}"')
+        files = get_files(db)
+        loaded = {}
+        for f, dfs in tqdm(get_transformed(files, workers), total=len(files)):
+            try:
+                load_file(f, dfs, db)
+            except pd.errors.ParserError:
+                logging.error(f'Error parsing file: {f}')
+                db.rollback()
+                continue
+            db.commit()
+            loaded[f] = files[f]
+        hasher.save_hashes(loaded, db)
         db.commit()
+    get_url_normalizer().save()
 # Loading (Desktop):7 ends here
@@ -1,13 +1,17 @@
 # [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):1]]
 import json
+import numpy as np
 import pandas as pd
 import logging
 
+import sqlalchemy as sa
 from tqdm import tqdm
 
 from sqrt_data_service.api import settings, DBConn, FileHasher
 from sqrt_data_service.models import Base
-from sqrt_data_service.common.locations import LocationMatcher
+from sqrt_data_service.models.aw import AndroidUnlock, AndroidCurrentWindow
+from sqrt_data_service.common.locations import get_location_matcher
+from sqrt_data_service.flows.aw.load import copy_to_staging
 # Loading (Android):1 ends here
 
 # [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):2]]
@@ -15,51 +19,172 @@ __all__ = ['aw_load_android']
 # Loading (Android):2 ends here
 
 # [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):3]]
-def get_dataframes(db):
-    hasher = FileHasher()
-    if not hasher.is_updated(settings["aw"]["android_file"], db):
-        logging.info('Android already loaded')
-        return
+def get_event_record(bucket, event):
+    return {
+        'id': f"{bucket['id']}-{event['id']}",
+        'bucket_id': bucket['id'],
+        'hostname': bucket['hostname'],
+        'duration': event['duration'],
+        'timestamp': event['timestamp'],
+        **event['data'],
+    }
+
+
+def iter_events(f):
+    import ijson
+
+    path = []
+    buckets = {}
+    pending = {}
+    builder = None
+    level = 0
+    for _, event, value in ijson.parse(f, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                level += 1
+            elif event in ('end_map', 'end_array'):
+                level -= 1
+            if level == 0:
+                bucket = buckets[path[1]]
+                if 'type' in bucket and 'hostname' in bucket:
+                    yield bucket, builder.value
+                else:
+                    pending[path[1]].append(builder.value)
+                builder = None
+            continue
+        if (
+            event == 'start_map' and len(path) == 4 and path[0] == 'buckets'
+            and path[2] == 'events'
+        ):
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            level = 1
+        elif event in ('start_map', 'start_array'):
+            if event == 'start_map' and len(path) == 2 and path[0] == 'buckets':
+                buckets[path[1]] = {'id': path[1]}
+                pending[path[1]] = []
+            path.append('item' if event == 'start_array' else None)
+        elif event == 'map_key':
+            path[-1] = value
+        elif event in ('end_map', 'end_array'):
+            path.pop()
+            if event == 'end_map' and len(path) == 2 and path[0] == 'buckets':
+                bucket = buckets.pop(path[1])
+                for pending_event in pending.pop(path[1]):
+                    yield bucket, pending_event
+        elif (
+            len(path) == 3 and path[0] == 'buckets'
+            and path[2] in ('id', 'type', 'hostname')
+        ):
+            buckets[path[1]][path[2]] = value
+            bucket = buckets[path[1]]
+            if 'type' in bucket and 'hostname' in bucket:
+                for pending_event in pending[path[1]]:
+                    yield bucket, pending_event
+                pending[path[1]] = []
+
+
+def iter_chunks(file_name):
+    chunk_size = settings['aw']['android_chunk_size']
+    records_by_type = {}
+    columns_by_type = {}
+
+    def make_chunk(type_):
+        df = pd.DataFrame(records_by_type.pop(type_))
+        if type_ in columns_by_type:
+            df = df.reindex(columns=columns_by_type[type_])
+        else:
+            columns_by_type[type_] = list(df.columns)
+        df['duration'] = df['duration'].astype(float)
+        return type_, df.set_index('id')
+
+    with open(file_name, 'rb') as f:
+        for bucket, event in iter_events(f):
+            records = records_by_type.setdefault(bucket['type'], [])
+            records.append(get_event_record(bucket, event))
+            if len(records) >= chunk_size:
+                yield make_chunk(bucket['type'])
+    for type_ in list(records_by_type.keys()):
+        yield make_chunk(type_)
+# Loading (Android):3 ends here
+
+# [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):4]]
+def read_dataframes(file_name):
     dfs_by_type = {}
-    with open(settings["aw"]["android_file"], 'r') as f:
+    with open(file_name, 'r') as f:
         data = json.load(f)
         buckets = data['buckets']
         for bucket in buckets.values():
             df = pd.DataFrame(
-                [
-                    {
-                        'id': f"{bucket['id']}-{event['id']}",
-                        'bucket_id': bucket['id'],
-                        'hostname': bucket['hostname'],
-                        'duration': event['duration'],
-                        'timestamp': pd.Timestamp(event['timestamp']),
-                        **event['data'],
-                    } for event in bucket['events']
-                ]
+                [get_event_record(bucket, event) for event in bucket['events']]
             )
             df = df.set_index('id')
             dfs_by_type[bucket['type']] = df
-    return dfs_by_type
-# Loading (Android):3 ends here
+    return dfs_by_type.items()
 
-# [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):4]]
+
+def get_dataframes(db):
+    hasher = FileHasher()
+    if not hasher.is_updated(settings["aw"]["android_file"], db):
+        logging.info('Android already loaded')
+        return
+    if settings['aw']['android_stream']:
+        return iter_chunks(settings["aw"]["android_file"])
+    return read_dataframes(settings["aw"]["android_file"])
+# Loading (Android):4 ends here
+
+# [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):5]]
 def get_records(type_, df):
-    loc = LocationMatcher()
+    loc = get_location_matcher()
     df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
-    locations = df.apply(
-        lambda row: loc.get_location(row.timestamp, row.hostname), axis=1
+    df['location'], df['timestamp'] = loc.get_locations(
+        df['timestamp'], df['hostname']
     )
-    df['location'] = [l[0] for l in locations]
-    df['timestamp'] = [l[1] for l in locations]
     return df
-# Loading (Android):4 ends here
+# Loading (Android):5 ends here
 
-# [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):5]]
-TABLE_NAMES = {
-    'os.lockscreen.unlocks': 'android_unlock',
-    'currentwindow': 'android_currentwindow'
+# [[file:../../../org/aw.org::*Loading (Android)][Loading (Android):6]]
+MODELS = {
+    'os.lockscreen.unlocks': AndroidUnlock,
+    'currentwindow': AndroidCurrentWindow
 }
 
+def get_watermarks(model, db):
+    event_id = sa.cast(
+        sa.func.substr(model.id, sa.func.char_length(model.bucket_id) + 2),
+        sa.BigInteger
+    )
+    watermarks = {}
+    for batch in DBConn.stream_columns(
+        db,
+        sa.select(model.bucket_id, sa.func.max(event_id).label('event_id'))
+        .group_by(model.bucket_id)
+    ):
+        watermarks.update(zip(batch['bucket_id'], batch['event_id']))
+    return watermarks
+
+def filter_new(df, watermarks):
+    event_ids = np.array(
+        [
+            int(id_[len(bucket_id) + 1:])
+            for id_, bucket_id in zip(df.index, df['bucket_id'])
+        ]
+    )
+    watermark = df['bucket_id'].map(watermarks).fillna(-1).to_numpy()
+    return df[event_ids >= watermark].copy()
+
+def upsert_data(model, df, db):
+    table = model.__table__
+    staging, columns = copy_to_staging(table, df.reset_index(), db)
+    column_list = ', '.join(columns)
+    update = ', '.join(f'{c} = EXCLUDED.{c}' for c in columns if c != 'id')
+    db.execute(
+        sa.text(
+            f'INSERT INTO {table.fullname} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT (id) DO UPDATE SET {update}'
+        )
+    )
+
 def aw_load_android():
     DBConn()
     DBConn.create_schema('aw', Base)
@@ -69,17 +194,34 @@ def aw_load_android():
         dfs_by_type = get_dataframes(db)
 
         if dfs_by_type is None:
+            db.commit()
             return
 
-        for type_, df in tqdm(dfs_by_type.items()):
-            df = get_records(type_, df)
-            df.to_sql(
-                TABLE_NAMES[type_],
-                schema=settings['aw']['schema'],
-                con=DBConn.engine,
-                if_exists='replace'
+        append = settings['aw']['android_load_method'] == 'append'
+        watermarks = {}
+        saved_types = set()
+        for type_, df in tqdm(dfs_by_type):
+            model = MODELS[type_]
+            if append:
+                if type_ not in watermarks:
+                    watermarks[type_] = get_watermarks(model, db)
+                df = filter_new(df, watermarks[type_])
+                if len(df) == 0:
+                    continue
+                df = get_records(type_, df)
+                upsert_data(model, df, db)
+            else:
+                df = get_records(type_, df)
+                df.to_sql(
+                    model.__tablename__,
+                    schema=settings['aw']['schema'],
+                    con=DBConn.engine,
+                    if_exists='append' if type_ in saved_types else 'replace'
+                )
+                saved_types.add(type_)
+            logging.info(
+                'Saved %d records of type "%s"', len(df), type_
             )
-            print(df)
-        hasher.save_hash(settings["aw"]["android_file"])
+        hasher.save_hash(settings["aw"]["android_file"], db)
         db.commit()
-# Loading (Android):5 ends here
+# Loading (Android):6 ends here
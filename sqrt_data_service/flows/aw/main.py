@@ -9,11 +9,13 @@ from .postprocessing import aw_postprocessing_init, aw_postprocessing_dispatch
 
 __all__ = ['aw_process']
 
-def aw_process(init=False):
-    aw_load_desktop()
+def aw_process(
+    init=False, workers=None, parallel=None, interval_workers=None
+):
+    aw_load_desktop(workers)
     aw_load_android()
     if init:
         aw_postprocessing_init()
-    aw_postprocessing_dispatch()
-    process_app_intervals()
+    aw_postprocessing_dispatch(parallel)
+    process_app_intervals(interval_workers)
 # Final flow:1 ends here
@@ -0,0 +1,184 @@
+# [[file:../../../org/aw.org::*Not-AFK window (NumPy)][Not-AFK window (NumPy):1]]
+import datetime
+import logging
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from sqrt_data_service.api import settings, DBConn
+# Not-AFK window (NumPy):1 ends here
+
+# [[file:../../../org/aw.org::*Not-AFK window (NumPy)][Not-AFK window (NumPy):2]]
+__all__ = [
+    'postprocess_notafkwindow_numpy', 'postprocess_notafkwindow_date_numpy'
+]
+
+AFK_COLUMNS = ['id', 'hostname', 'timestamp', 'duration', 'status']
+WINDOW_COLUMNS = [
+    'id', 'bucket_id', 'hostname', 'location', 'timestamp', 'duration', 'app',
+    'title'
+]
+TEXT_COLUMNS = ['id', 'bucket_id', 'hostname', 'location', 'app', 'title']
+EVENT_DTYPES = {'timestamp': 'datetime64[us]', 'duration': np.float64}
+# Not-AFK window (NumPy):2 ends here
+
+# [[file:../../../org/aw.org::*Not-AFK window (NumPy)][Not-AFK window (NumPy):3]]
+def get_events(db, table, columns, start, end):
+    batches = list(
+        DBConn.stream_columns(
+            db,
+            f'SELECT {", ".join(columns)} FROM aw.{table} '
+            'WHERE timestamp BETWEEN :start AND :end', {
+                'start': start,
+                'end': end
+            },
+            dtypes=EVENT_DTYPES
+        )
+    )
+    df = pd.DataFrame(
+        {
+            column: np.concatenate(
+                [batch[column] for batch in batches] or
+                [np.array([], dtype=EVENT_DTYPES.get(column, object))]
+            )
+            for column in columns
+        }
+    )
+    start_us = df['timestamp'].to_numpy(dtype='datetime64[us]').astype(np.int64)
+    df['start'] = start_us
+    df['end'] = start_us + np.rint(
+        df['duration'].to_numpy(dtype=np.float64) * 1e6
+    ).astype(np.int64)
+    return df
+# Not-AFK window (NumPy):3 ends here
+
+# [[file:../../../org/aw.org::*Not-AFK window (NumPy)][Not-AFK window (NumPy):4]]
+def expand_ranges(lo, hi):
+    counts = np.maximum(hi - lo, 0)
+    rows = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, np.repeat(lo, counts) + offsets
+
+def overlap_pairs(a_start, a_end, c_start, c_end):
+    a_lo, a_hi = np.minimum(a_start, a_end), np.maximum(a_start, a_end)
+    c_lo, c_hi = np.minimum(c_start, c_end), np.maximum(c_start, c_end)
+    a_order = np.argsort(a_lo, kind='stable')
+    c_order = np.argsort(c_lo, kind='stable')
+    a_sorted, c_sorted = a_lo[a_order], c_lo[c_order]
+
+    c_1, a_1 = expand_ranges(
+        np.searchsorted(a_sorted, c_lo, 'left'),
+        np.searchsorted(a_sorted, c_hi, 'right')
+    )
+    a_2, c_2 = expand_ranges(
+        np.searchsorted(c_sorted, a_lo, 'right'),
+        np.searchsorted(c_sorted, a_hi, 'left')
+    )
+    a_idx = np.concatenate([a_order[a_1], a_2])
+    c_idx = np.concatenate([c_1, c_order[c_2]])
+
+    as_, ae = a_lo[a_idx], a_hi[a_idx]
+    cs, ce = c_lo[c_idx], c_hi[c_idx]
+    mask = (as_ == cs) | ((as_ > cs) & (as_ < ce)) | ((as_ < cs) & (cs < ae))
+    return a_idx[mask], c_idx[mask]
+# Not-AFK window (NumPy):4 ends here
+
+# [[file:../../../org/aw.org::*Not-AFK window (NumPy)][Not-AFK window (NumPy):5]]
+def get_notafkwindow(db, process_date):
+    start = datetime.datetime.combine(process_date, datetime.time())
+    end = start + datetime.timedelta(days=1)
+    afk = get_events(db, 'afkstatus', AFK_COLUMNS, start, end)
+    window = get_events(db, 'currentwindow', WINDOW_COLUMNS, start, end)
+
+    a_idx, c_idx = [], []
+    for hostname, a_group in afk.groupby('hostname').indices.items():
+        c_group = np.flatnonzero(window['hostname'].to_numpy() == hostname)
+        a_pairs, c_pairs = overlap_pairs(
+            afk['start'].to_numpy()[a_group], afk['end'].to_numpy()[a_group],
+            window['start'].to_numpy()[c_group],
+            window['end'].to_numpy()[c_group]
+        )
+        a_idx.append(a_group[a_pairs])
+        c_idx.append(c_group[c_pairs])
+    if not a_idx:
+        return pd.DataFrame(columns=WINDOW_COLUMNS)
+    a_idx, c_idx = np.concatenate(a_idx), np.concatenate(c_idx)
+
+    a = afk.iloc[a_idx].reset_index(drop=True)
+    c = window.iloc[c_idx].reset_index(drop=True)
+
+    skip_app = (
+        c['app'].str.contains(settings['aw']['skip_afk_apps']) |
+        c['title'].str.contains(settings['aw']['skip_afk_titles'])
+    ).fillna(False).astype(bool)
+    is_afk = a['status'].eq(True).fillna(False).astype(bool) | (
+        a['status'].eq(False).fillna(False).astype(bool) &
+        (a['duration'] < int(settings['aw']['skip_afk_interval'])) & skip_app
+    )
+
+    start_us = np.maximum(a['start'], c['start'])
+    end_us = np.minimum(a['end'], c['end'])
+    result = pd.DataFrame(
+        {
+            'id':
+                'afkw-' + c['id'].str.extract(r'([0-9]+)$')[0].fillna('') +
+                '-' + a['id'].str.extract(r'([0-9]+)$')[0].fillna(''),
+            'bucket_id': c['bucket_id'],
+            'hostname': c['hostname'],
+            'location': c['location'],
+            'timestamp': start_us.to_numpy().astype('datetime64[us]'),
+            'duration': (end_us - start_us) / 1e6,
+            'app': c['app'].where(is_afk, 'AFK'),
+            'title': c['title'].where(is_afk, 'AFK'),
+        }
+    )
+    return result.sort_values('timestamp', ascending=False, kind='stable')
+# Not-AFK window (NumPy):5 ends here
+
+# [[file:../../../org/aw.org::*Not-AFK window (NumPy)][Not-AFK window (NumPy):6]]
+def save_notafkwindow(db, process_date, df):
+    db.execute(
+        sa.text(
+            "DELETE FROM aw.notafkwindow WHERE timestamp >= :date AND timestamp < CAST(:date AS date) + 1"
+        ), {'date': process_date}
+    )
+    db.execute('DROP TABLE IF EXISTS _notafkwindow_staging')
+    db.execute(
+        'CREATE TEMP TABLE _notafkwindow_staging '
+        '(LIKE aw.notafkwindow INCLUDING DEFAULTS)'
+    )
+    DBConn.copy_from_df(
+        db,
+        '_notafkwindow_staging',
+        df,
+        WINDOW_COLUMNS,
+        force_not_null=TEXT_COLUMNS
+    )
+    db.execute(
+        f"""
+    INSERT INTO aw.notafkwindow ({", ".join(WINDOW_COLUMNS)})
+    SELECT {", ".join(WINDOW_COLUMNS)} FROM _notafkwindow_staging
+    ON CONFLICT ON CONSTRAINT notafkwindow_pkey DO UPDATE SET timestamp = EXCLUDED.timestamp, duration = EXCLUDED.duration
+    """
+    )
+    db.execute('DROP TABLE _notafkwindow_staging')
+    db.execute(
+        sa.text("DELETE FROM aw._notafkwindow_dirty D WHERE D.date = :date"),
+        {'date': process_date}
+    )
+
+def postprocess_notafkwindow_date_numpy(db, process_date):
+    df = get_notafkwindow(db, process_date)
+    save_notafkwindow(db, process_date, df)
+    logging.info(
+        'Processed notafkwindow for %s: %d records', process_date, len(df)
+    )
+
+def postprocess_notafkwindow_numpy(db):
+    dates = db.execute(
+        sa.text("SELECT D.date FROM aw._notafkwindow_dirty D ORDER BY D.date")
+    ).scalars().all()
+    for process_date in dates:
+        postprocess_notafkwindow_date_numpy(db, process_date)
+# Not-AFK window (NumPy):6 ends here
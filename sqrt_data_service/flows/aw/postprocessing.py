@@ -1,5 +1,14 @@
-# [[file:../../../org/aw.org::*Post-processing][Post-processing:7]]
+# [[file:../../../org/aw.org::*Post-processing][Post-processing:13]]
+import concurrent.futures
+import logging
+
+import sqlalchemy as sa
+from tqdm import tqdm
+
 from sqrt_data_service.api import settings, DBConn
+from sqrt_data_service.flows.aw.notafkwindow import (
+    postprocess_notafkwindow_numpy, postprocess_notafkwindow_date_numpy
+)
 
 __all__ = ['aw_postprocessing_init', 'aw_postprocessing_dispatch']
 
@@ -8,28 +17,100 @@ drop procedure if exists aw.init_postprocessing();
 create procedure aw.init_postprocessing()
     language plpgsql as
 $$
+DECLARE
+    source_table text;
 begin
     drop table if exists aw.notafkwindow cascade;
     drop table if exists aw.notafktab cascade;
     drop table if exists aw._notafkwindow_meta cascade;
-    create table aw.notafkwindow (like aw.currentwindow including all);
+    drop table if exists aw._notafkwindow_dirty cascade;
+    IF EXISTS (SELECT FROM pg_partitioned_table P WHERE P.partrelid = 'aw.currentwindow'::regclass) THEN
+        create table aw.notafkwindow (like aw.currentwindow including all) partition by range (timestamp);
+    ELSE
+        create table aw.notafkwindow (like aw.currentwindow including all);
+    END IF;
+    create index notafkwindow_app_timestamp_idx on aw.notafkwindow (app, timestamp);
     create table aw.notafktab (like aw.webtab including all);
     create table aw._notafkwindow_meta (
         date date primary key,
         count int8
     );
+    create table aw._notafkwindow_dirty (
+        date date primary key
+    );
 
-    CREATE OR REPLACE VIEW aw._notafkwindow_meta_diff AS
-    WITH current_meta AS (
-        select date(timestamp) date, count(*) count
-        FROM aw.currentwindow
-        GROUP BY date(timestamp)
-        ORDER BY date ASC
-    )
-    SELECT CM.date
-    FROM current_meta CM
-             LEFT JOIN aw._notafkwindow_meta OM ON CM.date = OM.date
-    WHERE CM.count != OM.count OR OM.count IS NULL;
+    INSERT INTO aw._notafkwindow_meta
+    SELECT date(timestamp) date, count(*) count
+    FROM aw.currentwindow
+    GROUP BY date(timestamp);
+
+    INSERT INTO aw._notafkwindow_dirty
+    SELECT date(timestamp) FROM aw.currentwindow
+    UNION
+    SELECT date(timestamp) FROM aw.afkstatus;
+
+    FOREACH source_table IN ARRAY ARRAY['currentwindow', 'afkstatus']
+        LOOP
+            EXECUTE format(
+                'DROP TRIGGER IF EXISTS %1$s_insert_dates ON aw.%1$s;
+                 DROP TRIGGER IF EXISTS %1$s_update_dates ON aw.%1$s;
+                 DROP TRIGGER IF EXISTS %1$s_delete_dates ON aw.%1$s',
+                source_table
+            );
+            EXECUTE format(
+                'CREATE TRIGGER %1$s_insert_dates AFTER INSERT ON aw.%1$s
+                 REFERENCING NEW TABLE AS new_rows
+                 FOR EACH STATEMENT EXECUTE FUNCTION aw.track_notafkwindow_dates()',
+                source_table
+            );
+            EXECUTE format(
+                'CREATE TRIGGER %1$s_update_dates AFTER UPDATE ON aw.%1$s
+                 REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                 FOR EACH STATEMENT EXECUTE FUNCTION aw.track_notafkwindow_dates()',
+                source_table
+            );
+            EXECUTE format(
+                'CREATE TRIGGER %1$s_delete_dates AFTER DELETE ON aw.%1$s
+                 REFERENCING OLD TABLE AS old_rows
+                 FOR EACH STATEMENT EXECUTE FUNCTION aw.track_notafkwindow_dates()',
+                source_table
+            );
+        end loop;
+end;
+$$;
+drop function if exists aw.track_notafkwindow_dates cascade;
+create function aw.track_notafkwindow_dates() returns trigger
+    language plpgsql as
+$$
+begin
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO aw._notafkwindow_dirty
+        SELECT DISTINCT date(timestamp) FROM new_rows
+        ON CONFLICT DO NOTHING;
+        IF TG_TABLE_NAME = 'currentwindow' THEN
+            INSERT INTO aw._notafkwindow_meta AS M
+            SELECT date(timestamp) date, count(*) count
+            FROM new_rows
+            GROUP BY date(timestamp)
+            ON CONFLICT (date) DO UPDATE SET count = M.count + EXCLUDED.count;
+        END IF;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO aw._notafkwindow_dirty
+        SELECT DISTINCT date(timestamp) FROM old_rows
+        ON CONFLICT DO NOTHING;
+        IF TG_TABLE_NAME = 'currentwindow' THEN
+            UPDATE aw._notafkwindow_meta M
+            SET count = M.count - O.count
+            FROM (
+                SELECT date(timestamp) date, count(*) count
+                FROM old_rows
+                GROUP BY date(timestamp)
+            ) O
+            WHERE M.date = O.date;
+        END IF;
+    END IF;
+    RETURN NULL;
 end;
 $$;
 drop function if exists aw.is_afk;
@@ -77,30 +158,86 @@ begin
                 ((A.timestamp, A.timestamp + A.duration * interval '1 second')
                     overlaps
                  (C.timestamp, C.timestamp + C.duration * interval '1 second')) AND A.hostname = C.hostname
+                AND tsrange(A.timestamp + least(A.duration, 0) * interval '1 second', A.timestamp + greatest(A.duration, 0) * interval '1 second', '[]') &&
+                    tsrange(C.timestamp + least(C.duration, 0) * interval '1 second', C.timestamp + greatest(C.duration, 0) * interval '1 second', '[]')
         ORDER BY timestamp DESC;
 end;
 $$;
+drop procedure if exists aw.postprocess_notafkwindow_date;
+create procedure aw.postprocess_notafkwindow_date(process_date date)
+    language plpgsql AS
+$$
+begin
+    DELETE FROM aw.notafkwindow WHERE timestamp >= process_date AND timestamp < process_date + 1;
+    INSERT INTO aw.notafkwindow
+    SELECT *
+    FROM aw.get_notafkwindow(process_date, process_date + interval '1 day')
+    ON CONFLICT ON CONSTRAINT notafkwindow_pkey DO UPDATE SET timestamp = EXCLUDED.timestamp, duration = EXCLUDED.duration;
+    DELETE FROM aw._notafkwindow_dirty D WHERE D.date = process_date;
+end;
+$$;
 drop procedure if exists aw.postprocess_notafkwindow;
 create procedure aw.postprocess_notafkwindow()
     language plpgsql AS
 $$
 DECLARE
-    date date;
+    dirty_date date;
 begin
-    FOR date IN SELECT * FROM aw._notafkwindow_meta_diff
+    FOR dirty_date IN SELECT D.date FROM aw._notafkwindow_dirty D ORDER BY D.date
         LOOP
-            DELETE FROM aw.notafkwindow WHERE date(timestamp) = date;
-            INSERT INTO aw.notafkwindow
-            SELECT *
-            FROM aw.get_notafkwindow(date, date + interval '1 day')
-            ON CONFLICT (id) DO UPDATE SET timestamp = EXCLUDED.timestamp, duration = EXCLUDED.duration;
+            CALL aw.postprocess_notafkwindow_date(dirty_date);
         end loop;
-    DELETE FROM aw._notafkwindow_meta;
-    INSERT INTO aw._notafkwindow_meta
-    select date(timestamp) date, count(*) count
-    FROM aw.currentwindow
-    GROUP BY date(timestamp)
-    ORDER BY date;
+end;
+$$;
+drop function if exists aw.track_dirty_dates cascade;
+create function aw.track_dirty_dates() returns trigger
+    language plpgsql as
+$$
+begin
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        EXECUTE format(
+            'INSERT INTO %s SELECT DISTINCT date(timestamp) FROM new_rows ON CONFLICT DO NOTHING',
+            TG_ARGV[0]
+        );
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE format(
+            'INSERT INTO %s SELECT DISTINCT date(timestamp) FROM old_rows ON CONFLICT DO NOTHING',
+            TG_ARGV[0]
+        );
+    END IF;
+    RETURN NULL;
+end;
+$$;
+drop procedure if exists aw.create_dirty_date_triggers;
+create procedure aw.create_dirty_date_triggers(source_table text, dirty_table text, name text)
+    language plpgsql as
+$$
+begin
+    EXECUTE format(
+        'DROP TRIGGER IF EXISTS %1$s_insert_%2$s ON aw.%1$s;
+         DROP TRIGGER IF EXISTS %1$s_update_%2$s ON aw.%1$s;
+         DROP TRIGGER IF EXISTS %1$s_delete_%2$s ON aw.%1$s',
+        source_table, name
+    );
+    EXECUTE format(
+        'CREATE TRIGGER %1$s_insert_%2$s AFTER INSERT ON aw.%1$s
+         REFERENCING NEW TABLE AS new_rows
+         FOR EACH STATEMENT EXECUTE FUNCTION aw.track_dirty_dates(%3$L)',
+        source_table, name, dirty_table
+    );
+    EXECUTE format(
+        'CREATE TRIGGER %1$s_update_%2$s AFTER UPDATE ON aw.%1$s
+         REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+         FOR EACH STATEMENT EXECUTE FUNCTION aw.track_dirty_dates(%3$L)',
+        source_table, name, dirty_table
+    );
+    EXECUTE format(
+        'CREATE TRIGGER %1$s_delete_%2$s AFTER DELETE ON aw.%1$s
+         REFERENCING OLD TABLE AS old_rows
+         FOR EACH STATEMENT EXECUTE FUNCTION aw.track_dirty_dates(%3$L)',
+        source_table, name, dirty_table
+    );
 end;
 $$;
 drop procedure if exists aw.create_afkwindow_views();
@@ -108,9 +245,42 @@ create procedure aw.create_afkwindow_views()
     language plpgsql as
 $$
 begin
-    CREATE MATERIALIZED VIEW aw.notafkwindow_group AS
+    drop table if exists aw.notafkwindow_group;
+    drop table if exists aw._notafkwindow_group_dirty;
+    create table aw.notafkwindow_group (
+        hostname varchar(256),
+        location varchar(256),
+        date date,
+        total_minutes double precision,
+        app text,
+        title text
+    );
+    create index notafkwindow_group_date_idx on aw.notafkwindow_group (date);
+    create table aw._notafkwindow_group_dirty (
+        date date primary key
+    );
+
+    INSERT INTO aw._notafkwindow_group_dirty
+    SELECT DISTINCT date(timestamp) FROM aw.notafkwindow;
+
+    CALL aw.create_dirty_date_triggers('notafkwindow', 'aw._notafkwindow_group_dirty', 'group_dates');
+end;
+$$;
+drop procedure if exists aw.refresh_notafkwindow_group();
+create procedure aw.refresh_notafkwindow_group()
+    language plpgsql as
+$$
+DECLARE
+    dirty_dates date[];
+begin
+    WITH D AS (DELETE FROM aw._notafkwindow_group_dirty RETURNING date)
+    SELECT array_agg(D.date) INTO dirty_dates FROM D;
+    DELETE FROM aw.notafkwindow_group G WHERE G.date = ANY(dirty_dates);
+    INSERT INTO aw.notafkwindow_group
     SELECT hostname, location, date(timestamp) date, sum(duration) / (60) total_minutes, app, title
-    FROM aw.notafkwindow
+    FROM aw.notafkwindow N
+             INNER JOIN unnest(dirty_dates) D(date)
+                        ON N.timestamp >= D.date AND N.timestamp < D.date + 1
     GROUP BY hostname, location, date(timestamp), app, title;
 end;
 $$;
@@ -119,15 +289,70 @@ create procedure aw.create_browser_views()
     language plpgsql as
 $$
 begin
-    CREATE MATERIALIZED VIEW aw.webtab_active AS
+    drop table if exists aw.webtab_active;
+    drop table if exists aw.webtab_group;
+    drop table if exists aw._webtab_dirty;
+    drop table if exists aw._webtab_group_dirty;
+    create table aw.webtab_active (
+        bucket_id varchar(256),
+        location varchar(256),
+        timestamp timestamp,
+        duration numeric,
+        url text,
+        site text,
+        url_no_params text,
+        title text,
+        audible boolean,
+        tab_count integer
+    );
+    create index webtab_active_timestamp_idx on aw.webtab_active (timestamp);
+    create table aw.webtab_group (
+        location varchar(256),
+        date date,
+        total_minutes numeric,
+        site text,
+        url_no_params text,
+        title text,
+        audible boolean,
+        tab_count integer
+    );
+    create index webtab_group_date_idx on aw.webtab_group (date);
+    create table aw._webtab_dirty (
+        date date primary key
+    );
+    create table aw._webtab_group_dirty (
+        date date primary key
+    );
+
+    INSERT INTO aw._webtab_dirty
+    SELECT date(timestamp) FROM aw.webtab
+    UNION
+    SELECT date(timestamp) FROM aw.notafkwindow;
+
+    CALL aw.create_dirty_date_triggers('webtab', 'aw._webtab_dirty', 'dates');
+    CALL aw.create_dirty_date_triggers('notafkwindow', 'aw._webtab_dirty', 'webtab_dates');
+    CALL aw.create_dirty_date_triggers('webtab_active', 'aw._webtab_group_dirty', 'group_dates');
+end
+$$;
+drop procedure if exists aw.postprocess_webtab_date;
+create procedure aw.postprocess_webtab_date(process_date date)
+    language plpgsql AS
+$$
+begin
+    DELETE FROM aw.webtab_active WHERE timestamp >= process_date AND timestamp < process_date + 1;
+    INSERT INTO aw.webtab_active
     WITH W AS (
         SELECT *
         FROM aw.notafkwindow
-        WHERE app ~ current_setting('aw.webtab_apps')
-        ORDER BY timestamp
+        WHERE timestamp BETWEEN process_date AND process_date + interval '1 day'
+          AND app ~ current_setting('aw.webtab_apps')
     ),
-         T AS (SELECT * FROM aw.webtab WHERE url !~ current_setting('aw.skip_urls')),
-    res AS (
+         T AS (
+             SELECT *
+             FROM aw.webtab
+             WHERE timestamp BETWEEN process_date AND process_date + interval '1 day'
+               AND url !~ current_setting('aw.skip_urls')
+         )
     SELECT T.bucket_id,
            T.location,
            greatest(W.timestamp, T.timestamp) AS       timestamp,
@@ -146,13 +371,58 @@ begin
         ((W.timestamp, W.timestamp + W.duration * interval '1 second')
             overlaps
          (T.timestamp, T.timestamp + T.duration * interval '1 second'))
-    ORDER BY T.timestamp, T.id)
-    SELECT * FROM res;
-    CREATE MATERIALIZED VIEW aw.webtab_group AS
+        AND tsrange(W.timestamp + least(W.duration, 0) * interval '1 second', W.timestamp + greatest(W.duration, 0) * interval '1 second', '[]') &&
+            tsrange(T.timestamp + least(T.duration, 0) * interval '1 second', T.timestamp + greatest(T.duration, 0) * interval '1 second', '[]')
+    ORDER BY T.timestamp, T.id;
+    DELETE FROM aw._webtab_dirty D WHERE D.date = process_date;
+end;
+$$;
+drop procedure if exists aw.postprocess_webtab;
+create procedure aw.postprocess_webtab()
+    language plpgsql AS
+$$
+DECLARE
+    dirty_date date;
+begin
+    FOR dirty_date IN SELECT D.date FROM aw._webtab_dirty D ORDER BY D.date
+        LOOP
+            CALL aw.postprocess_webtab_date(dirty_date);
+        end loop;
+end;
+$$;
+drop procedure if exists aw.refresh_webtab_group();
+create procedure aw.refresh_webtab_group()
+    language plpgsql as
+$$
+DECLARE
+    dirty_dates date[];
+begin
+    WITH D AS (DELETE FROM aw._webtab_group_dirty RETURNING date)
+    SELECT array_agg(D.date) INTO dirty_dates FROM D;
+    DELETE FROM aw.webtab_group G WHERE G.date = ANY(dirty_dates);
+    INSERT INTO aw.webtab_group
     SELECT location, date(timestamp) date, sum(duration) / (60) total_minutes, site, url_no_params, title, audible, tab_count
-    FROM aw.webtab_active
+    FROM aw.webtab_active A
+             INNER JOIN unnest(dirty_dates) D(date)
+                        ON A.timestamp >= D.date AND A.timestamp < D.date + 1
     GROUP BY location, date(timestamp), site, url_no_params, title, audible, tab_count;
-end
+end;
+$$;
+drop procedure if exists aw.create_intervals_dirty();
+create procedure aw.create_intervals_dirty()
+    language plpgsql as
+$$
+begin
+    drop table if exists aw._intervals_dirty;
+    create table aw._intervals_dirty (
+        date date primary key
+    );
+
+    INSERT INTO aw._intervals_dirty
+    SELECT DISTINCT date(timestamp) FROM aw.notafkwindow;
+
+    CALL aw.create_dirty_date_triggers('notafkwindow', 'aw._intervals_dirty', 'intervals_dates');
+end;
 $$;
 """
 
@@ -178,15 +448,83 @@ def create_browser_views(db):
     db.execute("CALL aw.create_browser_views();")
 
 
+def create_intervals_dirty(db):
+    db.execute("CALL aw.create_intervals_dirty();")
+
+
+def ensure_notafkwindow_partitions(db):
+    start, end = db.execute(
+        "SELECT min(D.date), max(D.date) + 1 FROM aw._notafkwindow_dirty D"
+    ).one()
+    DBConn.ensure_partitions('aw.notafkwindow', start, end, db)
+
 def postprocess_notafkwindow(db):
-    db.execute("CALL aw.postprocess_notafkwindow();")
+    ensure_notafkwindow_partitions(db)
+    if settings['aw']['notafkwindow_engine'] == 'numpy':
+        postprocess_notafkwindow_numpy(db)
+    else:
+        db.execute("CALL aw.postprocess_notafkwindow();")
 
 def refresh_notafkwindow(db):
-    db.execute("REFRESH MATERIALIZED VIEW aw.notafkwindow_group;")
+    db.execute("CALL aw.refresh_notafkwindow_group();")
+
+def postprocess_webtab(db):
+    db.execute("CALL aw.postprocess_webtab();")
 
 def refresh_webtab(db):
-    db.execute("REFRESH MATERIALIZED VIEW aw.webtab_active;")
-    db.execute("REFRESH MATERIALIZED VIEW aw.webtab_group;")
+    db.execute("CALL aw.refresh_webtab_group();")
+
+def postprocess_notafkwindow_date(db, process_date):
+    if settings['aw']['notafkwindow_engine'] == 'numpy':
+        postprocess_notafkwindow_date_numpy(db, process_date)
+    else:
+        db.execute(
+            sa.text("CALL aw.postprocess_notafkwindow_date(:date);"),
+            {'date': process_date}
+        )
+
+def postprocess_webtab_date(db, process_date):
+    db.execute(
+        sa.text("CALL aw.postprocess_webtab_date(:date);"),
+        {'date': process_date}
+    )
+
+def get_dirty_dates(db, table):
+    return db.execute(
+        sa.text(f"SELECT D.date FROM {table} D ORDER BY D.date")
+    ).scalars().all()
+
+RETRY_PGCODES = {'40P01', '40001'}  # deadlock_detected, serialization_failure
+
+def process_date(process, date, retries=5):
+    for attempt in range(retries):
+        db = DBConn.Session()
+        try:
+            update_settings(db)
+            process(db, date)
+            db.commit()
+            return
+        except sa.exc.DBAPIError as exp:
+            pgcode = getattr(exp.orig, 'pgcode', None)
+            if pgcode not in RETRY_PGCODES or attempt == retries - 1:
+                raise
+            logging.warning(
+                'Retrying %s for %s: %s', process.__name__, date, pgcode
+            )
+        finally:
+            db.close()
+
+def process_dates(process, dates, parallel):
+    with concurrent.futures.ThreadPoolExecutor(parallel) as executor:
+        futures = [
+            executor.submit(process_date, process, date) for date in dates
+        ]
+        for future in tqdm(
+            concurrent.futures.as_completed(futures),
+            total=len(futures),
+            desc=process.__name__
+        ):
+            future.result()
 
 def aw_postprocessing_init():
     DBConn()
@@ -195,15 +533,35 @@ def aw_postprocessing_init():
         update_settings(db)
         init_postprocessing(db)
         create_afkwindow_views(db)
-        # create_browser_views
+        create_browser_views(db)
+        create_intervals_dirty(db)
+        db.commit()
+
+def aw_postprocessing_dispatch_parallel(parallel):
+    DBConn(pool_size=parallel)
+    with DBConn.get_session() as db:
+        ensure_notafkwindow_partitions(db)
+        db.commit()
+        dates = get_dirty_dates(db, 'aw._notafkwindow_dirty')
+    process_dates(postprocess_notafkwindow_date, dates, parallel)
+    with DBConn.get_session() as db:
+        dates = get_dirty_dates(db, 'aw._webtab_dirty')
+    process_dates(postprocess_webtab_date, dates, parallel)
+    with DBConn.get_session() as db:
+        update_settings(db)
+        refresh_notafkwindow(db)
+        refresh_webtab(db)
         db.commit()
 
-def aw_postprocessing_dispatch():
+def aw_postprocessing_dispatch(parallel=None):
+    if parallel is not None and parallel > 1:
+        return aw_postprocessing_dispatch_parallel(parallel)
     DBConn()
     with DBConn.get_session() as db:
         update_settings(db)
         postprocess_notafkwindow(db)
         refresh_notafkwindow(db)
-        # refresh_webtab(db)
+        postprocess_webtab(db)
+        refresh_webtab(db)
         db.commit()
-# Post-processing:7 ends here
+# Post-processing:13 ends here
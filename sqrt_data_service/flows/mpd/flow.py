@@ -1,4 +1,5 @@
 # [[file:../../../org/mpd.org::*Flow][Flow:1]]
+import io
 import os
 import sys
 import logging
@@ -7,12 +8,11 @@ import glob
 import pandas as pd
 from tqdm import tqdm
 
-import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from sqrt_data_service.api import settings, DBConn, FileHasher
 from sqrt_data_service.models import Base
-from sqrt_data_service.models.mpd import MpdSong, SongListened
+from sqrt_data_service.models.mpd import MpdSong
 # Flow:1 ends here
 
 # [[file:../../../org/mpd.org::*Flow][Flow:2]]
@@ -20,16 +20,29 @@ __init__ = ['load_mpd']
 # Flow:2 ends here
 
 # [[file:../../../org/mpd.org::*Loading the library][Loading the library:1]]
-def load_library():
+def get_library_path():
     csv_path = os.path.expanduser(settings['mpd']['library_csv'])
+    parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+    paths = [p for p in (csv_path, parquet_path) if os.path.exists(p)]
+    if len(paths) == 0:
+        return csv_path
+    return max(paths, key=os.path.getmtime)
+
+
+def load_library():
+    library_path = get_library_path()
     hasher = FileHasher()
 
-    if not hasher.is_updated(csv_path):
+    if not hasher.is_updated(library_path):
         logging.info('MPD library already saved, skipping')
         return
 
     logging.info('Saving MPD Library')
-    df = pd.read_csv(csv_path)
+    if library_path.endswith('.parquet'):
+        df = pd.read_parquet(library_path)
+        df = df.astype(object).where(df.notna(), None)
+    else:
+        df = pd.read_csv(library_path)
     DBConn.create_schema('mpd', Base)
 
     with DBConn.get_session() as db:
@@ -58,7 +71,7 @@ def load_library():
         )
 
         db.execute(upsert_stmt.values(song_data))
-        hasher.save_hash(csv_path, db)
+        hasher.save_hash(library_path, db)
         db.commit()
 
         logging.info(f'Saved {len(song_data)} records')
@@ -70,32 +83,67 @@ def get_logs_to_put():
     logs = glob.glob(f"{folder}/*.csv")
     hasher = FileHasher()
     with DBConn.get_session() as db:
-        return [log for log in logs if hasher.is_updated(log, db)]
+        logs = hasher.filter_updated(logs, db)
+        db.commit()
+    return logs
 # Loading the logs:1 ends here
 
 # [[file:../../../org/mpd.org::*Loading the logs][Loading the logs:2]]
+def read_log_tail(filename, offset):
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        f.seek(max(offset, len(header)))
+        start = f.tell()
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    df = pd.read_csv(io.BytesIO(header + data[:end]))
+    return df, start + end
+
+
+def insert_listened(db, df):
+    db.execute('DROP TABLE IF EXISTS _mpd_log_staging')
+    db.execute(
+        'CREATE TEMP TABLE _mpd_log_staging (file text NOT NULL, time timestamp NOT NULL)'
+    )
+    DBConn.copy_from_df(
+        db, '_mpd_log_staging', df, ['file', 'time'], force_not_null=['file']
+    )
+    not_found = db.execute(
+        """
+    SELECT DISTINCT L.file FROM _mpd_log_staging L
+    LEFT JOIN mpd."MpdSong" S ON S.file = L.file
+    WHERE S.id IS NULL
+    ORDER BY L.file
+    """
+    ).scalars().all()
+    inserted = db.execute(
+        """
+    INSERT INTO mpd."SongListened" (song_id, time)
+    SELECT S.id, L.time FROM _mpd_log_staging L
+    INNER JOIN mpd."MpdSong" S ON S.file = L.file
+    ON CONFLICT DO NOTHING
+    """
+    ).rowcount
+    db.execute('DROP TABLE _mpd_log_staging')
+    return inserted, not_found
+
+
 def put_log(filename):
-    logging.info('Reading %s', filename)
-    df = pd.read_csv(filename)
-    records = df.to_dict(orient='records')
-    all_found = True
     hasher = FileHasher()
+    offset, rows = hasher.get_ingested(filename)
+    logging.info('Reading %s from row %d', filename, rows)
+    df, offset = read_log_tail(filename, offset)
     with DBConn.get_session() as db:
-        for record in tqdm(records):
-            if record['type'] == 'skipped':
-                continue
-            song = db.execute(
-                sa.select(MpdSong).where(MpdSong.file == record['file'])
-            ).scalar_one_or_none()
-            if song:
-                listened = SongListened(song_id=song.id, time=record['time'])
-                db.merge(listened)
-            else:
-                logging.error('Song %s not found', record['file'])
-                all_found = False
-        if all_found:
-            hasher.save_hash(filename, db)
+        inserted, not_found = insert_listened(db, df[df['type'] != 'skipped'])
         db.commit()
+    logging.info('Saved %d listened records from %s', inserted, filename)
+    if len(not_found) > 0:
+        logging.error(
+            'Songs not found in %s (%d): %s', filename, len(not_found),
+            ', '.join(not_found)
+        )
+        return None
+    return hasher.get_ingested_state(filename, offset, rows + len(df))
 # Loading the logs:2 ends here
 
 # [[file:../../../org/mpd.org::*Post-processing][Post-processing:2]]
@@ -125,9 +173,13 @@ def load_mpd():
     load_library()
     logs = get_logs_to_put()
     logging.info(f'Found unprocessed MPD logs: {len(logs)}')
-    for log in logs:
-        put_log(log)
+    processed = {}
+    for log, state in logs.items():
+        ingested = put_log(log)
+        if ingested is not None:
+            processed[log] = {**state, **ingested}
         logging.info(f'Processed MPD log: {log}')
+    FileHasher().save_hashes(processed)
 
     create_views()
 # Flow:1 ends here
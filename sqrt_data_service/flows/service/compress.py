@@ -24,9 +24,9 @@ def get_date_group(timestamp):
 # [[file:../../../org/service.org::*Compression][Compression:4]]
 def get_files_to_compress():
     with DBConn.get_session() as db:
-        file_entries = db.execute(sa.select(FileHash)).scalars()
         files = [
-            f.file_name for f in file_entries if os.path.exists(f.file_name)
+            f for batch in DBConn.stream_columns(db, sa.select(FileHash.file_name))
+            for f in batch['file_name'] if os.path.exists(f)
         ]
 
     df = pd.DataFrame(
@@ -62,9 +62,9 @@ def compress(groups):
         return
 
     with DBConn.get_session() as db:
-        file_entries = db.execute(sa.select(FileHash)).scalars()
         files = [
-            f.file_name for f in file_entries if os.path.exists(f.file_name)
+            f for batch in DBConn.stream_columns(db, sa.select(FileHash.file_name))
+            for f in batch['file_name'] if os.path.exists(f)
         ]
 
         for date_group, dir, files in groups:
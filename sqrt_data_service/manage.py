@@ -74,6 +74,12 @@ def create_schema(name):
     DBConn()
     DBConn.create_schema(name, Base)
 
+@db.command(help='Create missing indexes concurrently')
+@click.option('-n', '--name', required=False, type=str, help='Schema')
+def ensure_indexes(name):
+    DBConn()
+    DBConn.ensure_indexes(Base, name)
+
 cli.add_command(db)
 # CLI entrypoint:5 ends here
 
@@ -1,4 +1,4 @@
-# [[file:../../../org/aw.org::*Source models][Source models:8]]
+# [[file:../../../org/aw.org::*Source models][Source models:10]]
 from .bucket import *
 from .afkstatus import *
 from .currentwindow import *
@@ -6,4 +6,6 @@ from .appeditor import *
 from .webtab import *
 from .android_unlock import *
 from .android_currentwindow import *
-# Source models:8 ends here
+from .notafkwindow import *
+from .app_interval import *
+# Source models:10 ends here
@@ -1,12 +1,12 @@
 # [[file:../../../org/aw.org::*Source models][Source models:2]]
 import sqlalchemy as sa
-from .bucket import Bucket
+from .bucket import PartitionedBucket, bucket_table_args
 
 __all__ = ['AfkStatus']
 
-class AfkStatus(Bucket):
+class AfkStatus(PartitionedBucket):
     __tablename__ = 'afkstatus'
-    __table_args__ = {'schema': 'aw'}
+    __table_args__ = bucket_table_args('afkstatus', ranges=True, partitioned=True)
 
     status = sa.Column(sa.Boolean(), nullable=False)
 # Source models:2 ends here
@@ -1,12 +1,12 @@
 # [[file:../../../org/aw.org::*Source models][Source models:7]]
 import sqlalchemy as sa
-from .bucket import Bucket
+from .bucket import Bucket, bucket_table_args
 
 __all__ = ['AndroidCurrentWindow']
 
 class AndroidCurrentWindow(Bucket):
     __tablename__ = 'android_currentwindow'
-    __table_args__ = {'schema': 'aw'}
+    __table_args__ = bucket_table_args('android_currentwindow')
 
     app = sa.Column(sa.Text(), nullable=False)
     classname = sa.Column(sa.Text(), nullable=False)
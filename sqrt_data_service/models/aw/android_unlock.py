@@ -1,10 +1,10 @@
 # [[file:../../../org/aw.org::*Source models][Source models:6]]
 import sqlalchemy as sa
-from .bucket import Bucket
+from .bucket import Bucket, bucket_table_args
 
 __all__ = ['AndroidUnlock']
 
 class AndroidUnlock(Bucket):
     __tablename__ = 'android_unlock'
-    __table_args__ = {'schema': 'aw'}
+    __table_args__ = bucket_table_args('android_unlock')
 # Source models:6 ends here
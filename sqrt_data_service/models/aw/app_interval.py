@@ -0,0 +1,21 @@
+# [[file:../../../org/aw.org::*Source models][Source models:9]]
+import sqlalchemy as sa
+from sqrt_data_service.models import Base
+
+__all__ = ['AppInterval', 'AppIntervalWatermark']
+
+class AppInterval(Base):
+    __tablename__ = 'intervals'
+    __table_args__ = {'schema': 'aw'}
+
+    app = sa.Column(sa.Text(), primary_key=True)
+    date = sa.Column(sa.Date(), primary_key=True)
+    seconds = sa.Column(sa.Float(), nullable=False)
+
+class AppIntervalWatermark(Base):
+    __tablename__ = '_intervals_meta'
+    __table_args__ = {'schema': 'aw'}
+
+    app = sa.Column(sa.Text(), primary_key=True)
+    timestamp = sa.Column(sa.DateTime(), nullable=False)
+# Source models:9 ends here
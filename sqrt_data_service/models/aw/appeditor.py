@@ -1,12 +1,12 @@
 # [[file:../../../org/aw.org::*Source models][Source models:4]]
 import sqlalchemy as sa
-from .bucket import Bucket
+from .bucket import Bucket, bucket_table_args
 
 __all__ = ['AppEditor']
 
 class AppEditor(Bucket):
     __tablename__ = 'appeditor'
-    __table_args__ = {'schema': 'aw'}
+    __table_args__ = bucket_table_args('appeditor')
 
     file = sa.Column(sa.Text(), nullable=False)
     project = sa.Column(sa.Text(), nullable=False)
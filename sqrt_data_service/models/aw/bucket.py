@@ -2,7 +2,29 @@
 import sqlalchemy as sa
 from sqrt_data_service.models import Base
 
-__all__ = ['Bucket']
+__all__ = ['Bucket', 'PartitionedBucket', 'bucket_table_args']
+
+
+def bucket_table_args(table, *indexes, ranges=False, partitioned=False):
+    args = [
+        sa.Index(f'{table}_timestamp_idx', 'timestamp', postgresql_using='brin'),
+        sa.Index(f'{table}_hostname_timestamp_idx', 'hostname', 'timestamp'),
+    ]
+    if ranges:
+        args.append(
+            sa.Index(
+                f'{table}_tsrange_idx',
+                sa.text(
+                    "tsrange(timestamp + least(duration, 0) * interval '1 second', "
+                    "timestamp + greatest(duration, 0) * interval '1 second', '[]')"
+                ),
+                postgresql_using='gist'
+            )
+        )
+    options = {'schema': 'aw'}
+    if partitioned:
+        options['postgresql_partition_by'] = 'RANGE (timestamp)'
+    return (*args, *indexes, options)
 
 
 class Bucket(Base):
@@ -18,4 +40,12 @@ class Bucket(Base):
     location = sa.Column(sa.String(256), nullable=False)
     timestamp = sa.Column(sa.DateTime(), nullable=False)
     duration = sa.Column(sa.Float(), nullable=False)
+
+
+class PartitionedBucket(Bucket):
+    __abstract__ = True
+
+    timestamp = sa.Column(sa.DateTime(), primary_key=True)
+    # redefined to keep the order of columns
+    duration = sa.Column(sa.Float(), nullable=False)
 # Source models:1 ends here
@@ -1,12 +1,12 @@
 # [[file:../../../org/aw.org::*Source models][Source models:3]]
 import sqlalchemy as sa
-from .bucket import Bucket
+from .bucket import PartitionedBucket, bucket_table_args
 
 __all__ = ['CurrentWindow']
 
-class CurrentWindow(Bucket):
+class CurrentWindow(PartitionedBucket):
     __tablename__ = 'currentwindow'
-    __table_args__ = {'schema': 'aw'}
+    __table_args__ = bucket_table_args('currentwindow', ranges=True, partitioned=True)
 
     app = sa.Column(sa.Text(), nullable=False)
     title = sa.Column(sa.Text(), nullable=False)
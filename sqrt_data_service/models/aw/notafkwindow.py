@@ -0,0 +1,18 @@
+# [[file:../../../org/aw.org::*Source models][Source models:8]]
+import sqlalchemy as sa
+from .bucket import PartitionedBucket, bucket_table_args
+
+__all__ = ['NotAfkWindow']
+
+class NotAfkWindow(PartitionedBucket):
+    __tablename__ = 'notafkwindow'
+    __table_args__ = bucket_table_args(
+        'notafkwindow',
+        sa.Index('notafkwindow_app_timestamp_idx', 'app', 'timestamp'),
+        ranges=True,
+        partitioned=True
+    )
+
+    app = sa.Column(sa.Text(), nullable=False)
+    title = sa.Column(sa.Text(), nullable=False)
+# Source models:8 ends here
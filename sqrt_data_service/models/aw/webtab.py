@@ -1,12 +1,12 @@
 # [[file:../../../org/aw.org::*Source models][Source models:5]]
 import sqlalchemy as sa
-from .bucket import Bucket
+from .bucket import PartitionedBucket, bucket_table_args
 
 __all__ = ['WebTab']
 
-class WebTab(Bucket):
+class WebTab(PartitionedBucket):
     __tablename__ = 'webtab'
-    __table_args__ = {'schema': 'aw'}
+    __table_args__ = bucket_table_args('webtab', ranges=True, partitioned=True)
 
     url = sa.Column(sa.Text(), nullable=False)
     site = sa.Column(sa.Text(), nullable=False)
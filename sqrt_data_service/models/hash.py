@@ -14,4 +14,9 @@ class FileHash(Base):
         primary_key=True,
     )
     hash = sa.Column(sa.String(256), nullable=False)
+    size = sa.Column(sa.BigInteger, nullable=True)
+    mtime = sa.Column(sa.Float, nullable=True)
+    offset = sa.Column(sa.BigInteger, nullable=True)
+    rows = sa.Column(sa.Integer, nullable=True)
+    prefix_hash = sa.Column(sa.String(256), nullable=True)
 # Hashes:1 ends here
@@ -0,0 +1,98 @@
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import declarative_base
+
+from sqrt_data_service.api import DBConn
+
+SCHEMA = 'test_ensure_indexes'
+
+Base = declarative_base()
+
+
+class Event(Base):
+    __tablename__ = 'event'
+    __table_args__ = (
+        sa.Index('event_timestamp_idx', 'timestamp'), {
+            'schema': SCHEMA,
+            'postgresql_partition_by': 'RANGE (timestamp)'
+        }
+    )
+
+    id = sa.Column(sa.String(256), primary_key=True)
+    timestamp = sa.Column(sa.DateTime(), primary_key=True)
+
+
+@pytest.fixture
+def db():
+    try:
+        DBConn()
+        with DBConn.engine.connect():
+            pass
+    except sa.exc.OperationalError as exp:
+        pytest.skip(f'No database: {exp}')
+    with DBConn.engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.exec_driver_sql(f'CREATE SCHEMA {SCHEMA}')
+        conn.exec_driver_sql(
+            f'CREATE TABLE {SCHEMA}.event (id varchar(256), timestamp timestamp, '
+            'PRIMARY KEY (id, timestamp)) PARTITION BY RANGE (timestamp)'
+        )
+    yield
+    with DBConn.engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA {SCHEMA} CASCADE')
+    DBConn.engine.dispose()
+    DBConn.reset()
+
+
+def get_indexes():
+    with DBConn.engine.connect() as conn:
+        return dict(
+            conn.execute(
+                sa.text(
+                    """
+            SELECT c.relname, i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname LIKE '%timestamp_idx'
+            """
+                ), {'schema': SCHEMA}
+            ).all()
+        )
+
+
+def create_partition(name, start, end):
+    with DBConn.engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"CREATE TABLE {SCHEMA}.{name} PARTITION OF {SCHEMA}.event "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+
+
+def test_ensure_indexes_without_partitions(db):
+    DBConn.ensure_indexes(Base, SCHEMA)
+    assert get_indexes() == {'event_timestamp_idx': True}
+
+
+def test_ensure_indexes_partitions(db):
+    DBConn.ensure_indexes(Base, SCHEMA)
+    create_partition('event_2022_01', '2022-01-01', '2022-02-01')
+    DBConn.ensure_indexes(Base, SCHEMA)
+    assert get_indexes() == {
+        'event_timestamp_idx': True,
+        'event_2022_01_timestamp_idx': True
+    }
+
+
+def test_ensure_indexes_interrupted(db):
+    create_partition('event_2022_01', '2022-01-01', '2022-02-01')
+    with DBConn.engine.begin() as conn:
+        conn.exec_driver_sql(
+            f'CREATE INDEX event_timestamp_idx ON ONLY {SCHEMA}.event (timestamp)'
+        )
+    assert get_indexes() == {'event_timestamp_idx': False}
+    DBConn.ensure_indexes(Base, SCHEMA)
+    DBConn.ensure_indexes(Base, SCHEMA)
+    assert get_indexes() == {
+        'event_timestamp_idx': True,
+        'event_2022_01_timestamp_idx': True
+    }
@@ -0,0 +1,75 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from sqrt_data_service.flows.aw.notafkwindow import overlap_pairs
+
+
+def pg_overlaps(s1, e1, s2, e2):
+    # PostgreSQL's OVERLAPS for non-null bounds, see overlaps_timestamp
+    if s1 > e1:
+        s1, e1 = e1, s1
+    if s2 > e2:
+        s2, e2 = e2, s2
+    if s1 > s2:
+        return s1 < e2
+    if s1 < s2:
+        return s2 < e1
+    return True
+
+
+def brute_force_pairs(a_start, a_end, c_start, c_end):
+    return {
+        (a, c)
+        for a, c in itertools.product(range(len(a_start)), range(len(c_start)))
+        if pg_overlaps(a_start[a], a_end[a], c_start[c], c_end[c])
+    }
+
+
+def get_pairs(a_start, a_end, c_start, c_end):
+    a_idx, c_idx = overlap_pairs(
+        np.array(a_start, dtype=np.int64), np.array(a_end, dtype=np.int64),
+        np.array(c_start, dtype=np.int64), np.array(c_end, dtype=np.int64)
+    )
+    pairs = list(zip(a_idx.tolist(), c_idx.tolist()))
+    assert len(pairs) == len(set(pairs))
+    return set(pairs)
+
+
+@pytest.mark.parametrize(
+    'a, c, expected', [
+        ((0, 10), (5, 15), True),
+        ((0, 10), (10, 20), False),
+        ((10, 20), (0, 10), False),
+        ((0, 10), (0, 0), True),
+        ((5, 5), (5, 5), True),
+        ((5, 5), (0, 10), True),
+        ((0, 10), (5, 5), True),
+        ((10, 0), (5, 15), True),
+        ((10, 0), (15, 5), True),
+        ((10, 0), (10, 20), False),
+        ((0, 10), (20, 10), False),
+        ((20, 10), (0, 10), False),
+        ((20, 0), (5, 5), True),
+    ]
+)
+def test_overlap_pairs_cases(a, c, expected):
+    assert pg_overlaps(*a, *c) == expected
+    pairs = get_pairs([a[0]], [a[1]], [c[0]], [c[1]])
+    assert pairs == ({(0, 0)} if expected else set())
+
+
+@pytest.mark.parametrize('negative', [False, True])
+def test_overlap_pairs_random(negative):
+    rng = np.random.default_rng(0)
+    low = -20 if negative else 0
+    for _ in range(1000):
+        n_a, n_c = rng.integers(0, 8, size=2)
+        a_start = rng.integers(0, 50, size=n_a)
+        c_start = rng.integers(0, 50, size=n_c)
+        a_end = a_start + rng.integers(low, 20, size=n_a)
+        c_end = c_start + rng.integers(low, 20, size=n_c)
+        assert get_pairs(a_start, a_end, c_start, c_end) == brute_force_pairs(
+            a_start, a_end, c_start, c_end
+        )